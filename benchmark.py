@@ -0,0 +1,224 @@
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from main import conduct_experiment, ENGINES
+from modules.structures import Mesh, get_root
+from modules import kernels
+
+TYPES = {
+    "NODE": Mesh.TYPE_NODE,
+    "BOND": Mesh.TYPE_BOND,
+}
+
+
+def measure(func, repeats):
+    # returns best time (s) over repeats runs and peak traced memory (bytes) of one more run (tracing slows code down,
+    #   so it is not done while timing). func(repeat) prepares its data and returns the function to be measured,
+    #   so preparation is not measured. Same repeat gives same seed, so reports of different runs are comparable
+    times = []
+    for repeat in range(repeats):
+        timed = func(repeat)
+        start = time.perf_counter()
+        timed()
+        times.append(time.perf_counter() - start)
+
+    timed = func(0)
+    tracemalloc.start()
+    timed()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return min(times), peak
+
+
+def filled_mesh(engine, size, mesh_type, seed, fraction=0.5):
+    # mesh with given fraction of items activated
+    mesh = engine(size, mesh_type, seed)
+    activate = mesh.activate_next_random_connection if mesh_type == Mesh.TYPE_BOND else mesh.activate_next_random_node
+    items_num = 2 * size * (size - 1) if mesh_type == Mesh.TYPE_BOND else size ** 2
+    for _ in range(int(items_num * fraction)):
+        activate()
+    return mesh
+
+
+def bench_conduct_experiment(engine, size, mesh_type):
+    return lambda repeat: lambda: conduct_experiment(size, mesh_type, engine=engine, seed=repeat)
+
+
+def bench_check_percollation(engine, size, mesh_type, calls=1000):
+    def prepare(repeat):
+        mesh = filled_mesh(engine, size, mesh_type, repeat)
+
+        def timed():
+            for _ in range(calls):
+                mesh.check_percollation()
+        return timed
+    return prepare
+
+
+def bench_combine_clusters(size, mesh_type):
+    # tree Mesh: merging random adjacent nodes pairs (_combine_clusters) and root search of every node (get_root)
+    def prepare(repeat):
+        mesh = Mesh(size, mesh_type, repeat)
+        if mesh_type == Mesh.TYPE_NODE:
+            # merged nodes are activated single node clusters like in a run (clusters statistics count them)
+            for node_id in range(size ** 2):
+                mesh.get_node(node_id).activate()
+            mesh._clusters_number = size ** 2
+            mesh.get_cluster_stats().add(1, size ** 2)
+        rnd = random.Random(repeat)
+        pairs = []
+        for _ in range(size ** 2):
+            node_id = rnd.randrange(size ** 2)
+            row_ind, col_ind = divmod(node_id, size)
+            adjacent = [node_id + 1] * (col_ind < size - 1) + [node_id + size] * (row_ind < size - 1)
+            if adjacent:
+                pairs.append([node_id, rnd.choice(adjacent)])
+
+        def timed():
+            for pair in pairs:
+                mesh._combine_clusters(pair)
+            for node_id in range(size ** 2):
+                get_root(mesh.get_node(node_id))
+        return timed
+    return prepare
+
+
+def bench_sweep(engine, sizes, mesh_type):
+    return lambda repeat: lambda: [conduct_experiment(size, mesh_type, engine=engine, seed=repeat) for size in sizes]
+
+
+def fit_exponent(sizes, values):
+    # empirical scaling exponent: slope of log(value) vs log(side size)
+    sizes, values = np.asarray(sizes, dtype=float), np.asarray(values, dtype=float)
+    ok = values > 0
+    if ok.sum() < 2:
+        return None
+    return float(np.polyfit(np.log(sizes[ok]), np.log(values[ok]), 1)[0])
+
+
+def run_benchmarks(sizes, engines, types, repeats):
+    benchmarks = {}
+
+    def add(name, sizes_list, make_func):
+        print("{}...".format(name), file=sys.stderr)
+        times, memory = [], []
+        for size in sizes_list:
+            t, m = measure(make_func(size), repeats)
+            times.append(t)
+            memory.append(m)
+        benchmarks[name] = {
+            "sizes": list(sizes_list),
+            "times": times,
+            "memory": memory,
+            "time_exponent": fit_exponent(sizes_list, times),
+            "memory_exponent": fit_exponent(sizes_list, memory),
+        }
+
+    for type_name in types:
+        mesh_type = TYPES[type_name]
+        for engine_name in engines:
+            engine = ENGINES[engine_name]
+            engine_sizes = [size for size in sizes if engine is not Mesh or size <= Mesh.NODES_NUM_LIMIT]
+            add("conduct_experiment/{}/{}".format(engine_name, type_name), engine_sizes,
+                lambda size: bench_conduct_experiment(engine, size, mesh_type))
+            add("check_percollation/{}/{}".format(engine_name, type_name), engine_sizes,
+                lambda size: bench_check_percollation(engine, size, mesh_type))
+
+            print("sweep/{}/{}...".format(engine_name, type_name), file=sys.stderr)
+            t, m = measure(bench_sweep(engine, engine_sizes, mesh_type), repeats)
+            benchmarks["sweep/{}/{}".format(engine_name, type_name)] = {
+                "sizes": engine_sizes, "times": [t], "memory": [m], "time_exponent": None, "memory_exponent": None,
+            }
+
+        tree_sizes = [size for size in sizes if size <= Mesh.NODES_NUM_LIMIT]
+        add("combine_clusters_get_root/TREE/{}".format(type_name), tree_sizes,
+            lambda size: bench_combine_clusters(size, mesh_type))
+
+    return {
+        "meta": {
+            "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "jit": kernels.JIT_AVAILABLE,
+            "machine": platform.machine(),
+            "repeats": repeats,
+        },
+        "benchmarks": benchmarks,
+    }
+
+
+def compare_reports(baseline, current, threshold):
+    # list of regressions: (benchmark, size, baseline time, current time); size None for whole sweep
+    regressions = []
+    for name, cur in current["benchmarks"].items():
+        base = baseline["benchmarks"].get(name)
+        if base is None:
+            continue
+        if name.startswith("sweep/"):
+            pairs = [(None, base["times"][0], cur["times"][0])] if base["sizes"] == cur["sizes"] else []
+        else:
+            base_times = dict(zip(base["sizes"], base["times"]))
+            pairs = [(size, base_times[size], t) for size, t in zip(cur["sizes"], cur["times"]) if size in base_times]
+        for size, base_time, cur_time in pairs:
+            if base_time > 0 and cur_time / base_time > 1 + threshold:
+                regressions.append((name, size, base_time, cur_time))
+    return regressions
+
+
+def print_report(report):
+    for name, res in report["benchmarks"].items():
+        exponent = res["time_exponent"]
+        print("{:45s} time exp: {:>6s}  mem exp: {:>6s}  times: {}".format(
+            name,
+            "-" if exponent is None else "{:.2f}".format(exponent),
+            "-" if res["memory_exponent"] is None else "{:.2f}".format(res["memory_exponent"]),
+            ", ".join("{:.2e}".format(t) for t in res["times"])))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmarks of simulation hot paths")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="Run benchmarks and write JSON report")
+    run_parser.add_argument("--sizes", "-s", type=int, nargs="+", default=[10, 20, 40, 80],
+                            help="Mesh side sizes")
+    run_parser.add_argument("--engines", "-e", nargs="+", choices=list(ENGINES), default=list(ENGINES))
+    run_parser.add_argument("--types", "-t", nargs="+", choices=list(TYPES), default=list(TYPES))
+    run_parser.add_argument("--repeats", "-r", type=int, default=3, help="Runs of every benchmark (best time is taken)")
+    run_parser.add_argument("--output", "-o", type=str, default="results/benchmark.json", help="Report path")
+
+    compare_parser = subparsers.add_parser("compare", help="Compare two reports and flag regressions")
+    compare_parser.add_argument("baseline", type=str)
+    compare_parser.add_argument("current", type=str)
+    compare_parser.add_argument("--threshold", type=float, default=0.1,
+                                help="Relative slowdown considered as regression")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        report = run_benchmarks(args.sizes, args.engines, args.types, args.repeats)
+        if os.path.dirname(args.output):
+            os.makedirs(os.path.dirname(args.output), exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print_report(report)
+        print("Report is written to {}".format(args.output))
+
+    if args.command == "compare":
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        with open(args.current) as f:
+            current = json.load(f)
+        regressions = compare_reports(baseline, current, args.threshold)
+        for name, size, base_time, cur_time in regressions:
+            print("REGRESSION {} (size {}): {:.2e}s -> {:.2e}s ({:+.0%})".format(
+                name, "all" if size is None else size, base_time, cur_time, cur_time / base_time - 1))
+        print("{} regressions found".format(len(regressions)))
+        sys.exit(1 if regressions else 0)
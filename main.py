@@ -1,50 +1,345 @@
 import argparse
+import csv
+import functools
+import json
+import secrets
+import signal
+import sys
+import time
 from modules.structures import Mesh
-from modules.visualizer import Visualizer
+from modules.array_mesh import ArrayMesh
+from modules.invasion import InvasionMesh
+from modules.instrumentation import Counters, phase
+from modules.raster import RasterVisualizer, PngFrameWriter
+from modules.event_log import EventLogWriter
+from modules.lattices import LATTICES, make_lattice
+from modules.orders import is_lazy_order
+from modules.results_store import ResultsStore
+from modules.result_cache import ResultCache, CACHE_MAX_BYTES, engine_version
+from modules.scheduler import task_seed
 from time import sleep
 
+# Tk (visualizer.Visualizer, raster.RasterVisualizer) and matplotlib (raster.PngFrameWriter) are imported only when
+#   they are used, so headless runs and pool workers importing conduct_experiment don't load them
+
+
+# mesh implementations: TREE - TreeNode objects (can be visualized), ARRAY - flat numpy arrays (large meshes)
+ENGINES = {
+    "TREE": Mesh,
+    "ARRAY": ArrayMesh,
+}
+
+CRITERIA = {
+    "VERTICAL": Mesh.SPAN_VERTICAL,
+    "HORIZONTAL": Mesh.SPAN_HORIZONTAL,
+    "EITHER": Mesh.SPAN_EITHER,
+    "BOTH": Mesh.SPAN_BOTH,
+}
+
+MESH_TYPES = {
+    "BOND": Mesh.TYPE_BOND,
+    "NODE": Mesh.TYPE_NODE,
+    "INVASION_NODE": Mesh.TYPE_INVASION_NODE,
+    "INVASION_BOND": Mesh.TYPE_INVASION_BOND,
+}
+
+TYPE_NAMES = {mesh_type: name for name, mesh_type in MESH_TYPES.items()}
+
+# output formats of runs results: TEXT - for a person, JSONL and CSV - one record per run (ResultsStore fields)
+OUTPUT_FORMATS = ("TEXT", "JSONL", "CSV")
+
+
+@functools.lru_cache(maxsize=16)
+def _cached_lattice(name, side_size):
+    # lattice tables are read only, so replicas of the same size share them
+    return make_lattice(name, side_size)
 
 
 # def activate_mesh_node(mesh, tgt_node_id):
 
-def conduct_experiment(mesh_size, mesh_type, visualize=False, pause=0.1):
-    mesh = Mesh(mesh_size, mesh_type)
+# stats - instrumentation.Counters to collect hot path counters and phases times into (None - disabled)
+# visualization frames are drawn not more often than max_fps, pause (s) slows down simulation (0 - full speed)
+# raster - raster.RasterVisualizer or raster.PngFrameWriter drawing cluster map of mesh (any engine and size)
+# event_log - event_log.EventLogWriter to record the run into (ARRAY engine only), it is closed at the end
+# periodic - torus mesh (ARRAY engine only), criterion is then checked for wrapping cluster
+# lattice - name of lattice geometry (see lattices.LATTICES), None - square lattice
+# state_dir - directory of out-of-core mesh state (ARRAY engine only). Run stopped with SIGINT (Ctrl+C) or SIGTERM
+#   is checkpointed there after the current activation, then KeyboardInterrupt is raised. Called with the same
+#   directory again, the run continues from the same point
+# observer - callable called with mesh after every activation, e.g. cluster_stats.ClusterStatsSampler
+# Invasion models (Mesh.TYPE_INVASION_*) are always run by invasion.InvasionMesh, activation is then invasion step and
+#   percollation is reaching the bottom row. trapping - invasion with trapping (site invasion only)
+def conduct_experiment(mesh_size, mesh_type, visualize=False, pause=0.1, engine=Mesh,
+                       criterion=Mesh.SPAN_VERTICAL, seed=None, stats=None, max_fps=RasterVisualizer.MAX_FPS,
+                       raster=None, event_log=None, periodic=False, lattice=None, state_dir=None, observer=None,
+                       trapping=False):
+    if mesh_type in (Mesh.TYPE_INVASION_NODE, Mesh.TYPE_INVASION_BOND):
+        engine = InvasionMesh
+    assert not trapping or engine is InvasionMesh, "Trapping is supported by invasion models only"
+    assert not visualize or engine is Mesh, "Only TREE engine can be visualized"
+    assert event_log is None or engine is ArrayMesh, "Only ARRAY engine runs can be logged"
+    assert state_dir is None or engine is ArrayMesh, "Only ARRAY engine supports out-of-core state"
+    assert not periodic or engine is ArrayMesh, "Only ARRAY engine supports periodic boundaries"
+    assert not visualize or lattice in (None, "SQUARE"), "Only square lattice can be visualized"
+    with phase(stats, "setup"):
+        engine_args = {}
+        if periodic:
+            engine_args["periodic"] = True
+        if lattice not in (None, "SQUARE"):
+            engine_args["lattice"] = _cached_lattice(lattice, mesh_size)
+        if state_dir is not None:
+            engine_args["state_dir"] = state_dir
+        if trapping:
+            engine_args["trapping"] = True
+        mesh = engine(mesh_size, mesh_type, seed, stats, **engine_args)
+        if event_log is not None:
+            mesh.set_event_log(event_log)
 
     if visualize:
-        v = Visualizer(mesh_type)
+        from modules.visualizer import Visualizer
+        v = Visualizer(mesh_type, max_fps)
+
+    # signals only set the flag, so mesh is never stopped in the middle of activation
+    stop_signals = []
+    if state_dir is not None:
+        handlers = {signum: signal.signal(signum, lambda signum, frame: stop_signals.append(signum))
+                    for signum in (signal.SIGINT, signal.SIGTERM)}
 
-    while not mesh.check_percollation():
-        if mesh_type == Mesh.TYPE_BOND:
-            mesh.activate_next_random_connection()
-        if mesh_type == Mesh.TYPE_NODE:
-            mesh.activate_next_random_node()
+    # the whole run in one call (union-find kernel when it is compiled), when nothing is done between activations
+    one_call = engine is ArrayMesh and stats is None and raster is None and observer is None and state_dir is None
+    if one_call:
+        mesh.activate_until(criterion)
+
+    while not one_call and not stop_signals:
+        with phase(stats, "spanning_check"):
+            if mesh.check_percollation(criterion):
+                break
+        with phase(stats, "activation"):
+            if mesh_type == Mesh.TYPE_BOND:
+                mesh.activate_next_random_connection()
+            if mesh_type == Mesh.TYPE_NODE:
+                mesh.activate_next_random_node()
+            if engine is InvasionMesh:
+                mesh.invade_next()
+        if observer is not None:
+            with phase(stats, "observation"):
+                observer(mesh)
         if visualize:
-            v.draw_mesh(mesh)
+            with phase(stats, "visualization"):
+                v.draw_mesh(mesh)
+        if raster is not None:
+            with phase(stats, "visualization"):
+                raster.draw_mesh(mesh)
+        if (visualize or raster is not None) and pause > 0:
             sleep(pause)
 
+    if state_dir is not None:
+        mesh.checkpoint()
+        for signum, handler in handlers.items():
+            signal.signal(signum, handler)
+        if stop_signals:
+            raise KeyboardInterrupt("Run is stopped, its state is saved to {}".format(state_dir))
+    if event_log is not None:
+        event_log.close()
+    if raster is not None:
+        raster.draw_mesh(mesh, force=True)
     if visualize:
+        v.draw_mesh(mesh, force=True)
         del v
     return mesh_size, mesh_type, mesh.calculate_percollation()
 
 
+@functools.lru_cache(maxsize=None)
+def open_result_cache(directory, max_bytes=CACHE_MAX_BYTES):
+    # result_cache.ResultCache of conduct_experiment results, one per process
+    return ResultCache(directory, engine_version(conduct_experiment), max_bytes)
+
+
+def _order_kind(mesh_size, mesh_type, periodic=False, lattice=None):
+    # "LAZY" or "PERMUTATION" activation order of the run (see orders.is_lazy_order), None for invasion models
+    if mesh_type not in (Mesh.TYPE_BOND, Mesh.TYPE_NODE):
+        return None
+    if lattice not in (None, "SQUARE"):
+        lattice = _cached_lattice(lattice, mesh_size)
+        items_num = lattice.bonds_num if mesh_type == Mesh.TYPE_BOND else lattice.nodes_num
+    else:
+        bonds_per_direction = mesh_size ** 2 if periodic else mesh_size * (mesh_size - 1)
+        items_num = 2 * bonds_per_direction if mesh_type == Mesh.TYPE_BOND else mesh_size ** 2
+    return "LAZY" if is_lazy_order(items_num) else "PERMUTATION"
+
+
+def _cache_key(cache, mesh_size, mesh_type, seed, engine=Mesh, criterion=Mesh.SPAN_VERTICAL, periodic=False,
+               lattice=None, trapping=False):
+    return cache.key(size=mesh_size, type=mesh_type, seed=seed, engine=engine.__name__, criterion=criterion,
+                     periodic=periodic, lattice="SQUARE" if lattice is None else lattice, trapping=trapping,
+                     order=_order_kind(mesh_size, mesh_type, periodic, lattice))
+
+
+def run_tasks(tasks, instrument=False, cache=None, **experiment_args):
+    # generator of records (ResultsStore fields) of headless runs of tasks (size, type, replica, seed) in this process,
+    #   instrument - add exported instrumentation.Counters of every run to its record ("stats").
+    #   cache - result_cache.ResultCache (see open_result_cache) results are taken from and put to, not used for
+    #   instrumented runs and runs with side effects (frames, log, state, observer).
+    #   experiment_args are passed to conduct_experiment
+    side_effects = ("raster", "event_log", "state_dir", "observer")
+    if instrument or any(experiment_args.get(name) is not None for name in side_effects):
+        cache = None
+    key_args = {name: value for name, value in experiment_args.items()
+                if name in ("engine", "criterion", "periodic", "lattice", "trapping")}
+    for mesh_size, mesh_type, replica, seed in tasks:
+        record = {
+            "size": mesh_size,
+            "type": mesh_type,
+            "replica": replica,
+            "seed": seed,
+        }
+        key = None if cache is None else _cache_key(cache, mesh_size, mesh_type, seed, **key_args)
+        cached = None if key is None else cache.get(key)
+        if cached is not None:
+            record.update(cached)
+            yield record
+            continue
+
+        stats = Counters() if instrument else None
+        start = time.time()
+        _, _, threshold = conduct_experiment(mesh_size, mesh_type, pause=0, seed=seed, stats=stats,
+                                             **experiment_args)
+        record["threshold"] = threshold
+        record["runtime"] = time.time() - start
+        if key is not None:
+            cache.put(key, {"threshold": threshold, "runtime": record["runtime"]})
+        if instrument:
+            record["stats"] = stats.export()
+        yield record
+
+
+def run_batch(sizes, types, replicas_num, master_seed=None, **experiment_args):
+    # records of replicas_num headless runs of every (size, type) pair, all in this process. Seed of every run is
+    #   derived from master_seed and run key (see scheduler.task_seed), so any run can be reproduced
+    master_seed = secrets.randbits(64) if master_seed is None else master_seed
+    tasks = ((mesh_size, mesh_type, replica, task_seed(master_seed, mesh_size, mesh_type, replica))
+             for mesh_type in types for mesh_size in sizes for replica in range(replicas_num))
+    return run_tasks(tasks, **experiment_args)
+
+
+def write_records(records, output_format, out=sys.stdout):
+    # every record is written (and flushed) as soon as its run is finished
+    if output_format == "CSV":
+        writer = csv.DictWriter(out, fieldnames=ResultsStore.FIELDS, lineterminator="\n")
+        writer.writeheader()
+    for record in records:
+        if output_format == "JSONL":
+            out.write(json.dumps(record) + "\n")
+        elif output_format == "CSV":
+            writer.writerow(record)
+        else:
+            out.write("Experiment finished! Size {}, type {}, replica {}. Items activated: {}\n".format(
+                record["size"], TYPE_NAMES[record["type"]], record["replica"],
+                record["threshold"]))
+        out.flush()
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
-    parser.add_argument("--sidesize", "-s", type=int, dest="size", required=True,
-                        help="Size size of modelling mesh (square) in nodes")
-    parser.add_argument("--type", "-t", type=str, choices=["BOND", "NODE"], required=True,
-                        help="Type of Model (BOND or NODE)")
-    parser.add_argument("--pause", "-p", type=float, default=1, help="Pause between nodes/bonds activation")
+    parser.add_argument("--sidesize", "-s", type=int, dest="sizes", nargs="+", required=True,
+                        help="Size size of modelling mesh (square) in nodes, several sizes for batch of runs")
+    parser.add_argument("--type", "-t", type=str, dest="types", nargs="+", choices=list(MESH_TYPES), required=True,
+                        help="Type of Model (BOND, NODE, INVASION_NODE or INVASION_BOND), several types for batch "
+                             "of runs")
+    parser.add_argument("--replicas", "-n", type=int, default=1, help="Number of runs of every size and type")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="Master seed runs seeds are derived from (default - random, it is printed in records)")
+    parser.add_argument("--format", "-f", type=str, choices=OUTPUT_FORMATS, default="TEXT",
+                        help="Results output: TEXT (waits for key press at the end), JSONL or CSV - one record per "
+                             "run on stdout, no prompt")
+    parser.add_argument("--cache", type=str, default=None,
+                        help="Directory of persistent cache of runs results (JSONL and CSV output and batches of runs)")
+    parser.add_argument("--cache-size", type=int, default=CACHE_MAX_BYTES,
+                        help="Cache size limit in bytes, least recently used results are removed above it")
+    parser.add_argument("--pause", "-p", type=float, default=0, help="Pause between nodes/bonds activation")
+    parser.add_argument("--fps", type=float, default=RasterVisualizer.MAX_FPS,
+                        help="Max frame rate of visualization")
     parser.add_argument("--vis", action="store_true", help="Show mesh visualization")
+    parser.add_argument("--raster", action="store_true",
+                        help="Show cluster map (one pixel/block per node) instead of nodes and bonds, any mesh size")
+    parser.add_argument("--frames", type=str, default=None,
+                        help="Directory to write cluster map PNG frames to (no display needed)")
+    parser.add_argument("--frames-every", type=int, default=1, help="Write PNG frame every N activations")
+    parser.add_argument("--log", type=str, default=None,
+                        help="Directory to record activations and merges of the run to (ARRAY engine only)")
+    parser.add_argument("--engine", "-e", type=str, choices=list(ENGINES), default="TREE",
+                        help="Mesh implementation (TREE or ARRAY). ARRAY has no side size limit")
+    parser.add_argument("--periodic", action="store_true",
+                        help="Periodic boundaries (torus, ARRAY engine only): percollation is wrapping around it")
+    parser.add_argument("--lattice", "-l", type=str, choices=list(LATTICES), default="SQUARE",
+                        help="Lattice geometry. CUBIC is 3-D simple cubic lattice of s^3 nodes")
+    parser.add_argument("--state", type=str, default=None,
+                        help="Directory to keep mesh state in memory mapped files (ARRAY engine only). "
+                             "Interrupted run is resumed by running with the same directory")
+    parser.add_argument("--trapping", action="store_true",
+                        help="Invasion with trapping: regions enclosed by invader are not invaded (INVASION_NODE)")
+    parser.add_argument("--criterion", "-c", type=str, choices=list(CRITERIA), default="VERTICAL",
+                        help="Percollation criterion: VERTICAL (up-to-down), HORIZONTAL (left-to-right), "
+                             "EITHER or BOTH of them")
     args = parser.parse_args()
 
-    assert 99 >= args.size >= 1, "Mesh size should be integer in [1; 50]"
-    assert args.pause > 0, "Pause should be > 0"
+    for size in args.sizes:
+        if args.engine == "TREE":
+            assert 99 >= size >= 1, "Mesh size should be integer in [1; 99]"
+        else:
+            assert size >= 1, "Mesh size should be positive integer"
+    assert args.replicas >= 1, "Replicas number should be positive"
+    assert args.pause >= 0, "Pause should be >= 0"
+    assert args.fps > 0, "Frame rate should be > 0"
+    single_run = len(args.sizes) == 1 and len(args.types) == 1 and args.replicas == 1
+    shows_run = args.vis or args.raster or args.frames is not None or args.log is not None or args.state is not None
+    assert single_run or not shows_run, "Visualization, frames, log and state are supported for a single run only"
+    assert args.format == "TEXT" or not (args.vis or args.raster), "Visualization needs TEXT output"
+
+    if args.format == "TEXT" and single_run:
+        raster = None
+        if args.raster:
+            raster = RasterVisualizer(max_fps=args.fps)
+        elif args.frames is not None:
+            raster = PngFrameWriter(args.frames, args.frames_every)
 
-    res = conduct_experiment(args.size,
-                             Mesh.TYPE_BOND if args.type == "BOND" else Mesh.TYPE_NODE,
-                             args.vis,
-                             args.pause)
+        # run seed is derived from master seed like in batches, so the same --seed reproduces the same run in any mode
+        master_seed = secrets.randbits(64) if args.seed is None else args.seed
+        print("Master seed: {}".format(master_seed))
+        res = conduct_experiment(args.sizes[0],
+                                 MESH_TYPES[args.types[0]],
+                                 args.vis,
+                                 args.pause,
+                                 ENGINES[args.engine],
+                                 CRITERIA[args.criterion],
+                                 seed=task_seed(master_seed, args.sizes[0], MESH_TYPES[args.types[0]], 0),
+                                 max_fps=args.fps,
+                                 raster=raster,
+                                 event_log=None if args.log is None else EventLogWriter(args.log),
+                                 periodic=args.periodic,
+                                 lattice=args.lattice,
+                                 state_dir=args.state,
+                                 trapping=args.trapping)
 
-    print("Experiment finished!")
-    print("Items activated: {}".format(res[2]))
-    input("Press any key to quit")
\ No newline at end of file
+        print("Experiment finished!")
+        print("Items activated: {}".format(res[2]))
+        input("Press any key to quit")
+    else:
+        experiment_args = {
+            "engine": ENGINES[args.engine],
+            "criterion": CRITERIA[args.criterion],
+            "periodic": args.periodic,
+            "lattice": args.lattice,
+            "trapping": args.trapping,
+        }
+        if args.frames is not None:
+            experiment_args["raster"] = PngFrameWriter(args.frames, args.frames_every)
+        if args.log is not None:
+            experiment_args["event_log"] = EventLogWriter(args.log)
+        if args.state is not None:
+            experiment_args["state_dir"] = args.state
+        if args.cache is not None:
+            experiment_args["cache"] = open_result_cache(args.cache, args.cache_size)
+        records = run_batch(args.sizes, [MESH_TYPES[t] for t in args.types], args.replicas, args.seed,
+                            **experiment_args)
+        write_records(records, args.format)
\ No newline at end of file
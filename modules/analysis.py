@@ -0,0 +1,183 @@
+import multiprocessing
+
+import numpy as np
+
+from modules.structures import Mesh
+
+# 1/nu values the free finite size scaling fit is searched over
+INV_NU_GRID = np.linspace(0.2, 2.5, 2000)
+BOOTSTRAP_DRAWS = 2000
+CONFIDENCE = 0.95
+# max number of resampled values held in memory at once by one process
+BOOTSTRAP_BLOCK_ELEMENTS = 2 ** 24
+
+
+def items_number(size, type):
+    return 2 * size * (size - 1) if type in (Mesh.TYPE_BOND, Mesh.TYPE_INVASION_BOND) else size ** 2
+
+
+def load_thresholds(store, type, chunk_rows=1000000):
+    # {side size: array of percollation thresholds as fractions of activated items} of all stored replicas of type,
+    #   store is read chunk by chunk and replicas are grouped by size with array operations
+    parts = {}
+    for chunk in store.iter_chunks(chunk_rows):
+        of_type = chunk["type"] == type
+        sizes = chunk["size"][of_type].astype(np.int64)
+        thresholds = chunk["threshold"][of_type]
+        order = np.argsort(sizes, kind="stable")
+        sizes, thresholds = sizes[order], thresholds[order]
+        cell_sizes, starts = np.unique(sizes, return_index=True)
+        for size, part in zip(cell_sizes.tolist(), np.split(thresholds, starts[1:])):
+            if items_number(size, type) > 0:
+                parts.setdefault(size, []).append(part / items_number(size, type))
+    return {size: np.concatenate(parts[size]) for size in sorted(parts)}
+
+
+def fit_sizes(thresholds):
+    # sizes usable for finite size scaling fit: with at least 2 replicas and non-zero thresholds spread
+    return [size for size, values in thresholds.items() if values.size > 1 and values.min() < values.max()]
+
+
+def _bootstrap_block(values, draws_num, rng):
+    # means and standard deviations of draws_num resamples (with replacement) of values
+    means, stds = np.empty(draws_num), np.empty(draws_num)
+    block = max(1, BOOTSTRAP_BLOCK_ELEMENTS // values.size)
+    for start in range(0, draws_num, block):
+        resampled = values[rng.integers(0, values.size, size=(min(block, draws_num - start), values.size))]
+        means[start:start + block] = resampled.mean(axis=1)
+        stds[start:start + block] = resampled.std(axis=1, ddof=1) if values.size > 1 else 0.
+    return means, stds
+
+
+_worker_cells = None
+
+
+def _init_worker(cells):
+    global _worker_cells
+    _worker_cells = cells
+
+
+def _bootstrap_task(args):
+    # (draws, sizes) arrays of resampled means and standard deviations of all cells
+    draws_num, seed = args
+    rng = np.random.default_rng(seed)
+    res = [_bootstrap_block(values, draws_num, rng) for values in _worker_cells]
+    return np.stack([means for means, _ in res], axis=1), np.stack([stds for _, stds in res], axis=1)
+
+
+def bootstrap(cells, draws_num=BOOTSTRAP_DRAWS, processes=None, seed=None, chunks_num=None):
+    # Resampled means and standard deviations of every cell (list of values arrays), arrays of shape (draws, cells).
+    #   Draws are split into chunks done by pool of processes (None - all cores, 1 - in this process), every chunk has
+    #   its own seed spawned from seed, so result does not depend on number of processes
+    processes = processes or multiprocessing.cpu_count()
+    chunks_num = chunks_num or 4 * processes
+    chunks_num = min(chunks_num, draws_num)
+    seeds = np.random.SeedSequence(seed).spawn(chunks_num)
+    tasks = [(len(draws), chunk_seed) for draws, chunk_seed in zip(np.array_split(np.arange(draws_num), chunks_num),
+                                                                     seeds)]
+    if processes == 1:
+        _init_worker(cells)
+        results = list(map(_bootstrap_task, tasks))
+    else:
+        with multiprocessing.Pool(processes, initializer=_init_worker, initargs=(cells,)) as pool:
+            results = pool.map(_bootstrap_task, tasks)
+    return np.concatenate([means for means, _ in results]), np.concatenate([stds for _, stds in results])
+
+
+def fit_finite_size_scaling(sizes, p_means, weights, inv_nu_grid=INV_NU_GRID):
+    # Weighted least squares fit of p(L) = p_c + a * L^(-1/nu) for every row of p_means (draws, sizes).
+    #
+    # For fixed 1/nu the model is linear in (p_c, a) and has closed form solution, so it is solved for all grid values
+    #   and all rows at once and the 1/nu with the least residual is taken for every row.
+    #   Returns arrays (draws,) of p_c, a and 1/nu
+    p_means = np.atleast_2d(p_means)
+    u = np.asarray(sizes, dtype=float)[None, :] ** -inv_nu_grid[:, None]          # (grid, sizes)
+    s0 = weights.sum()
+    s1 = u @ weights
+    s2 = (u ** 2) @ weights
+    t0 = p_means @ weights                                                         # (draws,)
+    t1 = (p_means * weights) @ u.T                                                 # (draws, grid)
+    det = s0 * s2 - s1 ** 2
+    a = (s0 * t1 - s1 * t0[:, None]) / det
+    p_c = (s2 * t0[:, None] - s1 * t1) / det
+    chi2 = ((p_means ** 2) @ weights)[:, None] - 2 * p_c * t0[:, None] - 2 * a * t1 \
+        + p_c ** 2 * s0 + 2 * p_c * a * s1 + a ** 2 * s2
+    best = np.argmin(chi2, axis=1)
+    rows = np.arange(p_means.shape[0])
+    return p_c[rows, best], a[rows, best], inv_nu_grid[best]
+
+
+def fit_fixed_exponent(sizes, p_means, weights, inv_nu):
+    # weighted least squares fit of p(L) = p_c + a * L^(-1/nu) with known 1/nu of every row (draws,).
+    #   Returns arrays (draws,) of p_c and a
+    p_means = np.atleast_2d(p_means)
+    u = np.asarray(sizes, dtype=float)[None, :] ** -np.reshape(inv_nu, (-1, 1))   # (draws, sizes)
+    s0 = weights.sum()
+    s1 = u @ weights
+    s2 = (u ** 2) @ weights
+    t0 = p_means @ weights
+    t1 = (p_means * u) @ weights
+    det = s0 * s2 - s1 ** 2
+    return (s2 * t0 - s1 * t1) / det, (s0 * t1 - s1 * t0) / det
+
+
+def fit_width_exponent(sizes, p_stds):
+    # 1/nu from thresholds distribution width: std(L) ~ L^(-1/nu), slope of log-log fit for every row (draws, sizes)
+    x = np.log(np.asarray(sizes, dtype=float))
+    y = np.log(np.maximum(np.atleast_2d(p_stds), 1e-300))
+    x = x - x.mean()
+    return -((y - y.mean(axis=1, keepdims=True)) @ x) / (x @ x)
+
+
+def _interval(values, confidence=CONFIDENCE):
+    return tuple(np.percentile(values, [50 * (1 - confidence), 50 * (1 + confidence)]).tolist())
+
+
+def analyze(thresholds, draws_num=BOOTSTRAP_DRAWS, processes=None, seed=None, confidence=CONFIDENCE):
+    # Finite size scaling analysis of {side size: thresholds fractions array} (see load_thresholds)
+    #   with bootstrap confidence intervals.
+    #
+    # nu is estimated from scaling of thresholds distribution width, std(L) ~ L^(-1/nu), and p_c from fit of mean
+    #   thresholds p(L) = p_c + a * L^(-1/nu) with this nu. Shift of mean thresholds is often too small to determine
+    #   nu by itself, so free fit of all three parameters is reported separately (nu_shift)
+    sizes = fit_sizes(thresholds)
+    assert len(sizes) >= 3, "At least 3 sizes with 2+ different thresholds are needed for finite size scaling fit"
+    cells = [thresholds[size] for size in sizes]
+    means = np.array([values.mean() for values in cells])
+    stds = np.array([values.std(ddof=1) for values in cells])
+    counts = np.array([values.size for values in cells])
+    # weights are inverse squared standard errors of means, the same for every draw
+    weights = counts / np.maximum(stds ** 2, 1e-12)
+
+    inv_nu = fit_width_exponent(sizes, stds)
+    p_c, a = fit_fixed_exponent(sizes, means, weights, inv_nu)
+    _, _, inv_nu_shift = fit_finite_size_scaling(sizes, means, weights)
+
+    boot_means, boot_stds = bootstrap(cells, draws_num, processes, seed)
+    boot_inv_nu = fit_width_exponent(sizes, boot_stds)
+    boot_p_c, boot_a = fit_fixed_exponent(sizes, boot_means, weights, boot_inv_nu)
+    _, _, boot_inv_nu_shift = fit_finite_size_scaling(sizes, boot_means, weights)
+
+    return {
+        "sizes": sizes,
+        "replicas": counts.tolist(),
+        "p_mean": means.tolist(),
+        "p_mean_interval": [_interval(boot_means[:, i], confidence) for i in range(len(sizes))],
+        "p_c": float(p_c[0]),
+        "p_c_interval": _interval(boot_p_c, confidence),
+        "a": float(a[0]),
+        "a_interval": _interval(boot_a, confidence),
+        "nu": float(1 / inv_nu[0]),
+        "nu_interval": _interval(1 / boot_inv_nu, confidence),
+        "nu_shift": float(1 / inv_nu_shift[0]),
+        "nu_shift_interval": _interval(1 / boot_inv_nu_shift, confidence),
+    }
+
+
+def format_analysis(res):
+    lines = ["p_c = {:.5f}  [{:.5f}; {:.5f}]".format(res["p_c"], *res["p_c_interval"]),
+             "nu (thresholds width) = {:.3f}  [{:.3f}; {:.3f}]".format(res["nu"], *res["nu_interval"]),
+             "nu (free fit of p(L)) = {:.3f}  [{:.3f}; {:.3f}]".format(res["nu_shift"], *res["nu_shift_interval"])]
+    for size, replicas, mean, interval in zip(res["sizes"], res["replicas"], res["p_mean"], res["p_mean_interval"]):
+        lines.append("L = {}: p = {:.5f}  [{:.5f}; {:.5f}] ({} replicas)".format(size, mean, *interval, replicas))
+    return "\n".join(lines)
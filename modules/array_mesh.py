@@ -0,0 +1,693 @@
+import itertools
+import json
+import os
+
+import numpy as np
+from modules.structures import Mesh, SEED, boundary_sentinels, spanning_by_criterion
+from modules.orders import index_dtype, activation_order, is_lazy_order
+from modules.lattices import grid_sentinels
+from modules.cluster_stats import ClusterStats
+from modules import kernels
+
+# out-of-core mode (see ArrayMesh): state files and number of nodes initialized at once
+STATE_META_FILE = "meta.json"
+STATE_NODES_FILE = "nodes.npy"
+STATE_BONDS_FILE = "bonds.npy"
+STATE_CHUNK = 2 ** 22
+# items of activation sequence passed to union-find kernel at once (see ArrayMesh.activate_until)
+KERNEL_BLOCK = 2 ** 16
+
+
+class ArrayMesh:
+    _size = None
+    _type = None
+
+    # union-find forest: _parents[i] is parent of node i, _cluster_sizes[r] is a size of cluster with root r
+    _parents = None
+    _cluster_sizes = None
+    # bit masks of sentinels (Mesh.SENTINEL_*) clusters are joined to, relevant only for roots
+    _root_sentinels = None
+
+    # periodic mesh only: displacement (columns, rows) from node to its parent on the unwrapped plane
+    _periodic = False
+    _parent_dx = None
+    _parent_dy = None
+
+    _active_nodes = None
+    # activation state of every bond (in bond ids order)
+    _bonds = None
+
+    # lattices.Lattice of geometry or None - square lattice computed arithmetically (no tables, less memory)
+    _lattice = None
+
+    # clusters of present nodes (all nodes in bond model, activated ones in node model) and size of the largest one
+    _clusters_number = None
+    _largest_cluster_size = None
+    _activated_items_number = 0
+    # cluster_stats.ClusterStats of present clusters
+    _cluster_stats = None
+
+    # one builds activation sequence of nodes or bonds ids - order in which they will be activated later
+    _random_items_gen = None
+    _items_number = None
+
+    # event_log.EventLogWriter activations and merges are written to (or None)
+    _event_log = None
+    # seed of activation sequence and if it is generated lazily (see orders.is_lazy_order)
+    _seed = None
+    _lazy_order = None
+
+    # out-of-core mode: directory of memory mapped state, its arrays and if state on disk is checkpointed
+    _state_dir = None
+    _state_arrays = None
+    _checkpointed = False
+
+    HORIZONTAL = Mesh.HORIZONTAL
+    VERTICAL = Mesh.VERTICAL
+
+    TYPE_BOND = Mesh.TYPE_BOND
+    TYPE_NODE = Mesh.TYPE_NODE
+
+    SPAN_VERTICAL = Mesh.SPAN_VERTICAL
+    SPAN_HORIZONTAL = Mesh.SPAN_HORIZONTAL
+    SPAN_EITHER = Mesh.SPAN_EITHER
+    SPAN_BOTH = Mesh.SPAN_BOTH
+
+    # Array-backed version of structures.Mesh (same k*k square mesh, same API).
+    #
+    # Instead of TreeNode objects the disjoint set forest is kept in two flat integer arrays
+    # (parents and cluster sizes), union is done by size and root search uses path halving,
+    # so memory is a few bytes per node and mesh side size is not limited.
+    #
+    # Only existing bonds are stored. Bond ids are:
+    #   [0; k*(k-1))          - horizontal bonds, bond b connects nodes (b // (k-1)) * k + b % (k-1) and the next one
+    #   [k*(k-1); 2*k*(k-1))  - vertical bonds, bond k*(k-1) + i connects nodes i and i + k
+    #
+    # Spanning is tracked with virtual sentinel clusters exactly like in Mesh (see Mesh.SENTINEL_*)
+    #
+    # Periodic mesh (torus) has no sides: last column is connected to the first one and last row to the first one,
+    #   so there are k*k bonds per direction with the same ids layout (horizontal bond b connects node b and its right
+    #   neighbour, vertical bond k*k + i connects node i and the one below it). Percollation there is wrapping: cluster
+    #   contains a loop going around the torus. Every node keeps displacement to its parent, so displacement to the
+    #   root is summed during root search. Bond joining two nodes of one cluster closes a loop, which wraps around
+    #   the torus if displacements of its ends to the root differ by more than the bond itself. So wrapping is
+    #   detected in the same near-constant time per union. Root sentinels of wrapping cluster get LEFT|RIGHT
+    #   (horizontal wrapping) and TOP|BOTTOM (vertical wrapping) bits, and criteria work the same way
+    #
+    # Mesh with lattice (lattices.Lattice) takes bonds, neighbours and sentinels from its tables instead,
+    #   so any lattice geometry (triangular, honeycomb, square with next nearest neighbours, simple cubic) is supported
+    #
+    # Out-of-core mode (state_dir is set) keeps state arrays in memory mapped files, so mesh size is limited by disk
+    #   instead of RAM. Per-node state (parent, cluster size, sentinels, activity, displacements) is one record of
+    #   nodes.npy, so a node is read and written with one page access, and nodes are stored row by row, so neighbours
+    #   in a row and rows of the mesh are near each other on disk. Bond flags are in bonds.npy. Activation order is
+    #   the same as in memory for the same seed (permutation array, lazy for huge meshes), so are the results.
+    #   checkpoint() flushes the arrays and writes counters to meta.json; mesh created with directory holding
+    #   checkpointed state resumes from it. State changed after the last checkpoint (e.g. by killed process)
+    #   can't be resumed.
+    #
+    # activate_until runs activation loop up to percollation in one call of kernels.activate_sequence, which is
+    #   compiled when Numba is installed (per-item methods are used otherwise), with bit-identical results
+
+    # lazy_order - generate activation sequence chunk by chunk instead of one permutation array
+    #   (None - only for huge meshes, see orders.LAZY_ORDER_THRESHOLD; resumed mesh takes it from the state)
+    # periodic - torus instead of square with open boundaries
+    # state_dir - directory for out-of-core state
+    def __init__(self, side_size: int, type: int, seed=None, stats=None, lazy_order=None, periodic=False,
+                 lattice=None, state_dir=None):
+        assert type == self.TYPE_BOND or type == self.TYPE_NODE, "Unacceptable mesh type"
+        assert side_size > 0, "Unacceptable mesh side size"
+        self._type = type
+        self._size = side_size
+        # instrumentation.Counters of hot paths or None (disabled)
+        self._stats = stats
+
+        self._periodic = periodic
+        self._lattice = lattice
+        assert lattice is None or not periodic, "Periodic boundaries are supported for square lattice only"
+        assert lattice is None or lattice.side_size == side_size, "Lattice of other side size"
+
+        nodes_num = self._nodes_number()
+        bonds_num = 2 * self._bonds_per_direction() if lattice is None else lattice.bonds_num
+        self._items_number = bonds_num if type == self.TYPE_BOND else nodes_num
+        seed = SEED if seed is None else seed
+
+        self._state_dir = state_dir
+        if state_dir is not None and os.path.exists(os.path.join(state_dir, STATE_META_FILE)):
+            seed = self._resume_state(lazy_order)
+        else:
+            if state_dir is not None and seed is None:
+                # resumed run has to regenerate the same activation order, so random seed is drawn and saved
+                seed = int(np.random.SeedSequence().generate_state(1)[0])
+            self._seed = seed
+            self._lazy_order = is_lazy_order(self._items_number, lazy_order)
+            self._create_state(nodes_num, bonds_num, index_dtype(max(nodes_num, bonds_num)))
+
+        self._random_items_gen = activation_order(self._items_number, seed, self._lazy_order,
+                                                  start=self._activated_items_number)
+
+    def _create_state(self, nodes_num, bonds_num, dtype):
+        self._clusters_number = nodes_num if self._type == self.TYPE_BOND else 0
+        self._largest_cluster_size = 1 if self._type == self.TYPE_BOND else 0
+        self._cluster_stats = ClusterStats({1: nodes_num} if self._type == self.TYPE_BOND else None)
+        self._activated_items_number = 0
+        self._spans_vertically = False
+        self._spans_horizontally = False
+
+        if self._state_dir is None:
+            self._parents = np.arange(nodes_num, dtype=dtype)
+            self._cluster_sizes = np.ones(nodes_num, dtype=dtype)
+            self._root_sentinels = np.zeros(nodes_num, dtype=np.uint8)
+            if self._periodic:
+                self._parent_dx = np.zeros(nodes_num, dtype=dtype)
+                self._parent_dy = np.zeros(nodes_num, dtype=dtype)
+            if self._type == self.TYPE_BOND:
+                self._bonds = np.zeros(bonds_num, dtype=bool)
+            if self._type == self.TYPE_NODE:
+                self._active_nodes = np.zeros(nodes_num, dtype=bool)
+        else:
+            os.makedirs(self._state_dir, exist_ok=True)
+            # new files are filled with zeros, only parents and sizes are initialized (chunk by chunk)
+            nodes = np.lib.format.open_memmap(os.path.join(self._state_dir, STATE_NODES_FILE), mode="w+",
+                                              dtype=self._node_record_dtype(dtype), shape=(nodes_num,))
+            for start in range(0, nodes_num, STATE_CHUNK):
+                stop = min(start + STATE_CHUNK, nodes_num)
+                nodes["parent"][start:stop] = np.arange(start, stop, dtype=dtype)
+                nodes["cluster_size"][start:stop] = 1
+            bonds = None
+            if self._type == self.TYPE_BOND:
+                bonds = np.lib.format.open_memmap(os.path.join(self._state_dir, STATE_BONDS_FILE), mode="w+",
+                                                  dtype=bool, shape=(bonds_num,))
+            self._map_state_arrays(nodes, bonds)
+
+        # in bond model all nodes are present from the beginning, so they join sentinels right away
+        if self._type == self.TYPE_BOND and not self._periodic:
+            self._init_boundary_sentinels()
+        if self._state_dir is not None:
+            self._write_state_meta(checkpointed=False)
+
+    def _node_record_dtype(self, dtype):
+        fields = [("parent", dtype), ("cluster_size", dtype), ("sentinels", np.uint8)]
+        if self._type == self.TYPE_NODE:
+            fields.append(("active", bool))
+        if self._periodic:
+            fields += [("dx", dtype), ("dy", dtype)]
+        return np.dtype(fields)
+
+    def _map_state_arrays(self, nodes, bonds):
+        # state arrays are views of memory mapped records fields
+        self._state_arrays = (nodes, bonds)
+        self._parents = nodes["parent"]
+        self._cluster_sizes = nodes["cluster_size"]
+        self._root_sentinels = nodes["sentinels"]
+        if self._type == self.TYPE_NODE:
+            self._active_nodes = nodes["active"]
+        if self._periodic:
+            self._parent_dx = nodes["dx"]
+            self._parent_dy = nodes["dy"]
+        self._bonds = bonds
+
+    def _state_meta(self, checkpointed):
+        return {
+            "size": self._size,
+            "type": self._type,
+            "periodic": self._periodic,
+            "lattice": None if self._lattice is None else self._lattice.name,
+            "seed": self._seed,
+            "lazy_order": self._lazy_order,
+            "clusters_number": self._clusters_number,
+            "largest_cluster_size": self._largest_cluster_size,
+            "cluster_sizes_histogram": self._cluster_stats.export(),
+            "activated_items_number": self._activated_items_number,
+            "spans_vertically": self._spans_vertically,
+            "spans_horizontally": self._spans_horizontally,
+            "checkpointed": checkpointed,
+        }
+
+    def _write_state_meta(self, checkpointed):
+        path = os.path.join(self._state_dir, STATE_META_FILE)
+        with open(path + ".tmp", "w") as f:
+            json.dump(self._state_meta(checkpointed), f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+        self._checkpointed = checkpointed
+
+    def _resume_state(self, lazy_order):
+        # opens checkpointed out-of-core state, returns seed of its activation order
+        with open(os.path.join(self._state_dir, STATE_META_FILE)) as f:
+            meta = json.load(f)
+        assert meta["checkpointed"], "State was changed after the last checkpoint and can't be resumed"
+        assert (meta["size"], meta["type"], meta["periodic"]) == (self._size, self._type, self._periodic), \
+            "State of mesh with other parameters"
+        assert meta["lattice"] == (None if self._lattice is None else self._lattice.name), "State of other lattice"
+
+        nodes = np.lib.format.open_memmap(os.path.join(self._state_dir, STATE_NODES_FILE), mode="r+")
+        bonds = None
+        if self._type == self.TYPE_BOND:
+            bonds = np.lib.format.open_memmap(os.path.join(self._state_dir, STATE_BONDS_FILE), mode="r+")
+        self._map_state_arrays(nodes, bonds)
+        self._seed = meta["seed"]
+        # states written before the kind of order was stored always used lazy order
+        self._lazy_order = meta.get("lazy_order", True)
+        assert lazy_order is None or bool(lazy_order) == self._lazy_order, "State of other activation order kind"
+        self._clusters_number = meta["clusters_number"]
+        self._largest_cluster_size = meta["largest_cluster_size"]
+        self._cluster_stats = ClusterStats(dict(meta["cluster_sizes_histogram"]))
+        self._activated_items_number = meta["activated_items_number"]
+        self._spans_vertically = meta["spans_vertically"]
+        self._spans_horizontally = meta["spans_horizontally"]
+        self._checkpointed = True
+        return self._seed
+
+    def checkpoint(self):
+        # out-of-core mode: flushes state to disk, so the run can be resumed from this point
+        assert self._state_dir is not None, "Only out-of-core mesh can be checkpointed"
+        for array in self._state_arrays:
+            if array is not None:
+                array.flush()
+        self._write_state_meta(checkpointed=True)
+
+    def _nodes_number(self):
+        return self._size ** 2 if self._lattice is None else self._lattice.nodes_num
+
+    def _bonds_per_direction(self):
+        # square lattice only
+        return self._size ** 2 if self._periodic else self._size * (self._size - 1)
+
+    def _init_boundary_sentinels(self):
+        nodes_num = self._nodes_number()
+        for start in range(0, nodes_num, STATE_CHUNK):
+            stop = min(start + STATE_CHUNK, nodes_num)
+            self._root_sentinels[start:stop] = self.get_nodes_sentinels(np.arange(start, stop))
+        if self._size == 1:
+            self._update_spanning(int(self._root_sentinels[0]))
+
+    def _update_spanning(self, sentinels):
+        if sentinels & Mesh.SENTINEL_TOP and sentinels & Mesh.SENTINEL_BOTTOM:
+            self._spans_vertically = True
+        if sentinels & Mesh.SENTINEL_LEFT and sentinels & Mesh.SENTINEL_RIGHT:
+            self._spans_horizontally = True
+
+    def _is_node_id_ok(self, node_id):
+        return 0 <= node_id < self._nodes_number()
+
+    def _bond_nodes(self, bond_id):
+        if self._lattice is not None:
+            node1_id, node2_id = self._lattice.bond_nodes[bond_id].tolist()
+            return node1_id, node2_id
+        if self._periodic:
+            nodes_num = self._size ** 2
+            if bond_id < nodes_num:
+                return bond_id, bond_id - bond_id % self._size + (bond_id + 1) % self._size
+            return bond_id - nodes_num, (bond_id - nodes_num + self._size) % nodes_num
+        bonds_per_direction = self._size * (self._size - 1)
+        if bond_id < bonds_per_direction:
+            node_id = (bond_id // (self._size - 1)) * self._size + bond_id % (self._size - 1)
+            return node_id, node_id + 1
+        node_id = bond_id - bonds_per_direction
+        return node_id, node_id + self._size
+
+    def _get_adjacent_node_ids(self, node_id):
+        if self._lattice is not None:
+            return self._lattice.get_neighbours(node_id)
+        row_ind, col_ind = divmod(node_id, self._size)
+        adjacent = []
+        if row_ind > 0:
+            adjacent.append(node_id - self._size)
+        if row_ind < self._size - 1:
+            adjacent.append(node_id + self._size)
+        if col_ind > 0:
+            adjacent.append(node_id - 1)
+        if col_ind < self._size - 1:
+            adjacent.append(node_id + 1)
+        return adjacent
+
+    def _get_periodic_adjacent(self, node_id):
+        # (adjacent node id, columns step, rows step) of all 4 neighbours on torus
+        row_start = node_id - node_id % self._size
+        nodes_num = self._size ** 2
+        return [(row_start + (node_id + 1) % self._size, 1, 0),
+                (row_start + (node_id - 1) % self._size, -1, 0),
+                ((node_id + self._size) % nodes_num, 0, 1),
+                ((node_id - self._size) % nodes_num, 0, -1)]
+
+    def _get_root_displacement(self, node_id):
+        # (root, columns displacement, rows displacement) from node to root of periodic mesh, path halving keeps
+        #   displacements to parents: re-linked node gets sum of its and its parent displacements
+        parents, parent_dx, parent_dy = self._parents, self._parent_dx, self._parent_dy
+        dx = dy = 0
+        path_length = 0
+        parent = parents[node_id]
+        while parent != node_id:
+            grandparent = parents[parent]
+            parent_dx[node_id] += parent_dx[parent]
+            parent_dy[node_id] += parent_dy[parent]
+            parents[node_id] = grandparent
+            dx += int(parent_dx[node_id])
+            dy += int(parent_dy[node_id])
+            path_length += 1
+            node_id = grandparent
+            parent = parents[node_id]
+        if self._stats is not None:
+            self._stats.add("find_calls")
+            self._stats.add("find_path_length", path_length)
+        return int(node_id), dx, dy
+
+    def _combine_periodic_clusters(self, node1_id, node2_id, step):
+        # step - (columns, rows) displacement from node1 to node2 made by joining bond
+        root1, dx1, dy1 = self._get_root_displacement(node1_id)
+        root2, dx2, dy2 = self._get_root_displacement(node2_id)
+        # displacement from root1 to root2 through the new bond
+        dx, dy = step[0] + dx2 - dx1, step[1] + dy2 - dy1
+        if root1 == root2:
+            # loop is closed, it goes around torus if it does not return to the same point of unwrapped plane
+            sentinels = int(self._root_sentinels[root1])
+            if dx != 0:
+                sentinels |= Mesh.SENTINEL_LEFT | Mesh.SENTINEL_RIGHT
+            if dy != 0:
+                sentinels |= Mesh.SENTINEL_TOP | Mesh.SENTINEL_BOTTOM
+            self._root_sentinels[root1] = sentinels
+            self._update_spanning(sentinels)
+            return False
+
+        if self._cluster_sizes[root1] < self._cluster_sizes[root2]:
+            root1, root2, dx, dy = root2, root1, -dx, -dy
+        self._cluster_stats.merge(int(self._cluster_sizes[root1]), int(self._cluster_sizes[root2]))
+        self._parents[root2] = root1
+        self._parent_dx[root2] = -dx
+        self._parent_dy[root2] = -dy
+        self._cluster_sizes[root1] += self._cluster_sizes[root2]
+        self._clusters_number -= 1
+        if self._stats is not None:
+            self._stats.add("unions")
+        self._largest_cluster_size = max(self._largest_cluster_size, int(self._cluster_sizes[root1]))
+        self._root_sentinels[root1] |= self._root_sentinels[root2]
+        self._update_spanning(int(self._root_sentinels[root1]))
+        return True
+
+    def _get_root(self, node_id):
+        if self._stats is not None:
+            return self._get_root_counted(node_id)
+        # path halving: every visited node is re-linked to its grandparent
+        parents = self._parents
+        parent = parents[node_id]
+        while parent != node_id:
+            grandparent = parents[parent]
+            parents[node_id] = grandparent
+            node_id = grandparent
+            parent = parents[node_id]
+        return int(node_id)
+
+    def _get_root_counted(self, node_id):
+        # _get_root which updates instrumentation counters
+        parents = self._parents
+        path_length = 0
+        relinked = 0
+        parent = parents[node_id]
+        while parent != node_id:
+            grandparent = parents[parent]
+            path_length += 1 if grandparent == parent else 2
+            relinked += grandparent != parent
+            parents[node_id] = grandparent
+            node_id = grandparent
+            parent = parents[node_id]
+        self._stats.add("find_calls")
+        self._stats.add("find_path_length", path_length)
+        self._stats.add("compressions", int(relinked))
+        return int(node_id)
+
+    def _combine_clusters(self, node1_id, node2_id):
+        root1, root2 = self._get_root(node1_id), self._get_root(node2_id)
+        if root1 == root2:
+            return False
+
+        # union by size: smaller tree is attached to the root of bigger one
+        if self._cluster_sizes[root1] < self._cluster_sizes[root2]:
+            root1, root2 = root2, root1
+        self._cluster_stats.merge(int(self._cluster_sizes[root1]), int(self._cluster_sizes[root2]))
+        self._parents[root2] = root1
+        self._cluster_sizes[root1] += self._cluster_sizes[root2]
+        self._clusters_number -= 1
+        if self._stats is not None:
+            self._stats.add("unions")
+        self._largest_cluster_size = max(self._largest_cluster_size, int(self._cluster_sizes[root1]))
+        if self._event_log is not None:
+            self._event_log.merge(root1, root2, int(self._cluster_sizes[root1]))
+
+        sentinels = self._root_sentinels[root1] | self._root_sentinels[root2]
+        self._root_sentinels[root1] = sentinels
+        self._update_spanning(sentinels)
+        return True
+
+    def _next_item(self):
+        if self._checkpointed:
+            # state on disk is going to differ from the checkpoint
+            self._write_state_meta(checkpointed=False)
+        return next(self._random_items_gen, None)
+
+    def _activate_bond(self, bond_id):
+        res = {"bond_not_exists": None,
+               "bond_already_activated": None,
+               "clusters_merged": None}
+
+        if self._bonds[bond_id]:
+            res["bond_already_activated"] = True
+            if self._stats is not None:
+                self._stats.add("wasted_activations")
+            return res
+        self._bonds[bond_id] = True
+        self._activated_items_number += 1
+
+        if self._periodic:
+            step = (1, 0) if bond_id < self._bonds_per_direction() else (0, 1)
+            res["clusters_merged"] = int(self._combine_periodic_clusters(*self._bond_nodes(bond_id), step))
+        else:
+            res["clusters_merged"] = int(self._combine_clusters(*self._bond_nodes(bond_id)))
+        return res
+
+    def activate_next_random_connection(self):
+        next_connection = self._next_item()
+        if next_connection is None:
+            return None
+        if self._event_log is not None:
+            self._event_log.activation(next_connection)
+
+        res = self._activate_bond(next_connection)
+
+        res["next_connection"] = next_connection
+        if res["clusters_merged"] and self._clusters_number == 1:
+            res["one_cluster_left"] = True
+
+        return res
+
+    def activate_next_random_node(self):
+        next_node_id = self._next_item()
+        if next_node_id is None:
+            return None
+        if self._event_log is not None:
+            self._event_log.activation(next_node_id)
+
+        self._active_nodes[next_node_id] = True
+        self._activated_items_number += 1
+        self._clusters_number += 1
+        self._largest_cluster_size = max(self._largest_cluster_size, 1)
+        self._cluster_stats.add(1)
+        if self._periodic:
+            for adjacent_id, step_x, step_y in self._get_periodic_adjacent(next_node_id):
+                if self._active_nodes[adjacent_id]:
+                    self._combine_periodic_clusters(next_node_id, adjacent_id, (step_x, step_y))
+            return
+        sentinels = boundary_sentinels(next_node_id, self._size) if self._lattice is None \
+            else int(self._lattice.node_sentinels[next_node_id])
+        self._root_sentinels[next_node_id] = sentinels
+        self._update_spanning(sentinels)
+        for adjacent_id in self._get_adjacent_node_ids(next_node_id):
+            if self._active_nodes[adjacent_id]:
+                self._combine_clusters(next_node_id, adjacent_id)
+
+    def _kernel_supported(self):
+        # kernel has no periodic boundaries, event log and instrumentation counters
+        return not self._periodic and self._event_log is None and self._stats is None
+
+    def activate_until(self, criterion=SPAN_VERTICAL, kernel=None):
+        # activates items of activation sequence until percollation by criterion or the end of sequence.
+        #   kernel - run the whole loop in kernels.activate_sequence (None - when it is compiled and supports the mesh,
+        #   True - also without Numba, i.e. in python), results are the same as of per-item activation either way
+        if kernel is None:
+            kernel = kernels.JIT_AVAILABLE and self._kernel_supported()
+        if not kernel:
+            while not self.check_percollation(criterion):
+                if self._type == self.TYPE_BOND:
+                    if self.activate_next_random_connection() is None:
+                        break
+                    continue
+                activated = self._activated_items_number
+                self.activate_next_random_node()
+                if self._activated_items_number == activated:
+                    break
+            return
+        assert self._kernel_supported(), "Kernel supports only not periodic meshes without event log and counters"
+
+        if self._checkpointed:
+            self._write_state_meta(checkpointed=False)
+        lattice = self._lattice
+        tables = kernels.empty_tables() if lattice is None else \
+            (lattice.bond_nodes, lattice.neighbour_offsets, lattice.neighbours, lattice.node_sentinels)
+        active = self._bonds if self._type == self.TYPE_BOND else self._active_nodes
+        counters = np.zeros(kernels.COUNTERS_NUM, dtype=np.int64)
+        counters[kernels.COUNTER_ACTIVATED] = self._activated_items_number
+        counters[kernels.COUNTER_CLUSTERS] = self._clusters_number
+        counters[kernels.COUNTER_LARGEST] = self._largest_cluster_size
+        counters[kernels.COUNTER_SPANS_VERTICALLY] = self._spans_vertically
+        counters[kernels.COUNTER_SPANS_HORIZONTALLY] = self._spans_horizontally
+        while not spanning_by_criterion(bool(counters[kernels.COUNTER_SPANS_VERTICALLY]),
+                                        bool(counters[kernels.COUNTER_SPANS_HORIZONTALLY]), criterion):
+            block = np.fromiter(itertools.islice(self._random_items_gen, KERNEL_BLOCK), dtype=np.int64)
+            if block.size == 0:
+                break
+            taken = kernels.activate_sequence(block, self._type == self.TYPE_NODE, criterion, self._size,
+                                              lattice is not None, *tables, self._parents, self._cluster_sizes,
+                                              self._root_sentinels, active, counters)
+            if taken < block.size:
+                # items after percollation stay in the sequence
+                self._random_items_gen = itertools.chain(block[taken:].tolist(), self._random_items_gen)
+                break
+
+        self._activated_items_number = int(counters[kernels.COUNTER_ACTIVATED])
+        self._clusters_number = int(counters[kernels.COUNTER_CLUSTERS])
+        self._largest_cluster_size = int(counters[kernels.COUNTER_LARGEST])
+        self._spans_vertically = bool(counters[kernels.COUNTER_SPANS_VERTICALLY])
+        self._spans_horizontally = bool(counters[kernels.COUNTER_SPANS_HORIZONTALLY])
+        self._rebuild_cluster_stats()
+
+    def set_event_log(self, event_log):
+        # event_log.EventLogWriter (None - stop logging). It records current state as the first snapshot
+        assert event_log is None or not self._periodic, "Runs on periodic mesh can't be logged"
+        self._event_log = event_log
+        if event_log is not None:
+            event_log.start(self)
+
+    def set_activation_order(self, items):
+        # iterable of items ids to be activated next instead of the random sequence (e.g. recorded one)
+        self._random_items_gen = iter(items)
+
+    def get_state(self):
+        # whole mesh state (except activation sequence) as dict of numpy arrays and numbers, arrays are not copied
+        state = {
+            "parents": self._parents,
+            "cluster_sizes": self._cluster_sizes,
+            "root_sentinels": self._root_sentinels,
+            "clusters_number": self._clusters_number,
+            "largest_cluster_size": self._largest_cluster_size,
+            "activated_items_number": self._activated_items_number,
+            "spans_vertically": self._spans_vertically,
+            "spans_horizontally": self._spans_horizontally,
+        }
+        if self._type == self.TYPE_BOND:
+            state["bonds"] = self._bonds
+        else:
+            state["active_nodes"] = self._active_nodes
+        if self._periodic:
+            state["parent_dx"] = self._parent_dx
+            state["parent_dy"] = self._parent_dy
+        return state
+
+    def set_state(self, state):
+        # state of mesh of the same size and type, as returned by get_state
+        assert state["parents"].size == self._nodes_number(), "State of mesh of other size"
+        assert self._state_dir is None, "Out-of-core mesh state is resumed from its directory"
+        self._parents = state["parents"]
+        self._cluster_sizes = state["cluster_sizes"]
+        self._root_sentinels = state["root_sentinels"]
+        self._clusters_number = int(state["clusters_number"])
+        self._largest_cluster_size = int(state["largest_cluster_size"])
+        self._activated_items_number = int(state["activated_items_number"])
+        self._spans_vertically = bool(state["spans_vertically"])
+        self._spans_horizontally = bool(state["spans_horizontally"])
+        if self._type == self.TYPE_BOND:
+            self._bonds = state["bonds"]
+        else:
+            self._active_nodes = state["active_nodes"]
+        if self._periodic:
+            self._parent_dx = state["parent_dx"]
+            self._parent_dy = state["parent_dy"]
+        self._rebuild_cluster_stats()
+
+    def _rebuild_cluster_stats(self):
+        # clusters statistics are rebuilt from sizes of present roots (O(nodes))
+        roots = self._parents == np.arange(self._parents.size)
+        if self._type == self.TYPE_NODE:
+            roots &= self._active_nodes
+        self._cluster_stats = ClusterStats.from_sizes(self._cluster_sizes[roots])
+
+    def is_periodic(self):
+        return self._periodic
+
+    def get_lattice(self):
+        # lattices.Lattice or None (square lattice without tables)
+        return self._lattice
+
+    def get_nodes_sentinels(self, node_ids):
+        # sentinels (Mesh.SENTINEL_* mask) of mesh sides nodes lie on, array of node ids
+        if self._lattice is not None:
+            return self._lattice.node_sentinels[node_ids]
+        rows, cols = np.divmod(node_ids, self._size)
+        return grid_sentinels(rows, cols, self._size, self._size)
+
+    def get_size(self):
+        return self._size
+
+    def get_type(self):
+        return self._type
+
+    def get_items_number(self):
+        # number of items (nodes or bonds) which can be activated
+        return self._items_number
+
+    def get_clusters_number(self):
+        return self._clusters_number
+
+    def get_largest_cluster_size(self):
+        return self._largest_cluster_size
+
+    def get_nodes_number(self):
+        return self._nodes_number()
+
+    def get_cluster_stats(self):
+        # cluster_stats.ClusterStats kept up to date by the mesh (histogram n_s, mean size, susceptibility, ..)
+        return self._cluster_stats
+
+    def get_root_id(self, node_id: int):
+        assert self._is_node_id_ok(node_id), "Wrong node id"
+        return self._get_root(node_id)
+
+    def get_cluster_size(self, node_id: int):
+        return int(self._cluster_sizes[self.get_root_id(node_id)])
+
+    def get_root_ids(self):
+        # root id of every node, vectorized pointer jumping (forest itself is not changed)
+        roots = self._parents.copy()
+        while True:
+            next_roots = roots[roots]
+            if np.array_equal(next_roots, roots):
+                return roots
+            roots = next_roots
+
+    def get_present_nodes(self):
+        # nodes which belong to clusters: all in bond model, activated ones in node model
+        if self._type == self.TYPE_BOND:
+            return np.ones(self._nodes_number(), dtype=bool)
+        return self._active_nodes.copy()
+
+    def get_roots_sentinels(self, root_ids):
+        # sentinels (Mesh.SENTINEL_* mask) of clusters with given roots
+        return self._root_sentinels[root_ids]
+
+    def check_percollation(self, criterion=SPAN_VERTICAL):
+        if self._stats is not None:
+            self._stats.add("spanning_checks")
+        return spanning_by_criterion(self._spans_vertically, self._spans_horizontally, criterion)
+
+    def calculate_percollation(self):
+        return self._activated_items_number
@@ -0,0 +1,148 @@
+import numpy as np
+from modules.structures import Mesh, SEED, spanning_by_criterion
+from modules.orders import index_dtype
+
+
+class BatchMesh:
+    _size = None
+    _type = None
+    _replicas_num = None
+
+    # state of all replicas, shape (R, N) flattened to (R * N,): node i of replica r has global index r * N + i
+    _parents = None
+    _cluster_sizes = None
+    _root_sentinels = None
+    _active_nodes = None
+
+    # (R, items_number) - own activation sequence of every replica
+    _activation_orders = None
+
+    TYPE_BOND = Mesh.TYPE_BOND
+    TYPE_NODE = Mesh.TYPE_NODE
+
+    # R independent replicas of ArrayMesh (same side size and type) simulated in lockstep.
+    #
+    # On every step each replica which does not percollate yet activates next item of its own activation sequence.
+    #   Root search and union are done with numpy for all replicas at once (every replica does at most one union per
+    #   direction, so there are no conflicts between replicas), so the Python loop runs over steps, not replicas.
+    # Bond ids are the same as in ArrayMesh.
+
+    def __init__(self, side_size: int, type: int, replicas_num: int, seed=None):
+        assert type == self.TYPE_BOND or type == self.TYPE_NODE, "Unacceptable mesh type"
+        assert side_size > 0, "Unacceptable mesh side size"
+        assert replicas_num > 0, "Unacceptable replicas number"
+        self._type = type
+        self._size = side_size
+        self._replicas_num = replicas_num
+
+        nodes_num = self._size ** 2
+        bonds_per_direction = self._size * (self._size - 1)
+        items_num = 2 * bonds_per_direction if type == self.TYPE_BOND else nodes_num
+        dtype = index_dtype(max(nodes_num * replicas_num, items_num))
+
+        self._parents = np.arange(nodes_num * replicas_num, dtype=dtype)
+        self._cluster_sizes = np.ones(nodes_num * replicas_num, dtype=dtype)
+        self._root_sentinels = np.zeros(nodes_num * replicas_num, dtype=np.uint8)
+        self._replica_offsets = np.arange(replicas_num, dtype=dtype) * nodes_num
+
+        rng = np.random.default_rng(SEED if seed is None else seed)
+        # independent permutation per replica: argsort of random keys (Generator.permuted needs numpy >= 1.20)
+        self._activation_orders = np.argsort(rng.random((replicas_num, items_num)), axis=1).astype(dtype)
+
+        node_sentinels = self._boundary_sentinels().ravel()
+        if type == self.TYPE_BOND:
+            self._root_sentinels[:] = np.tile(node_sentinels, replicas_num)
+        if type == self.TYPE_NODE:
+            self._active_nodes = np.zeros(nodes_num * replicas_num, dtype=bool)
+            self._node_sentinels = node_sentinels
+
+    def _boundary_sentinels(self):
+        sentinels = np.zeros((self._size, self._size), dtype=np.uint8)
+        sentinels[0, :] |= Mesh.SENTINEL_TOP
+        sentinels[-1, :] |= Mesh.SENTINEL_BOTTOM
+        sentinels[:, 0] |= Mesh.SENTINEL_LEFT
+        sentinels[:, -1] |= Mesh.SENTINEL_RIGHT
+        return sentinels
+
+    def _get_roots(self, node_ids):
+        # vectorized root search with path halving, node_ids are global indices (no duplicates per replica)
+        parents = self._parents
+        while True:
+            node_parents = parents[node_ids]
+            not_roots = node_parents != node_ids
+            if not not_roots.any():
+                return node_ids
+            grandparents = parents[node_parents]
+            parents[node_ids] = grandparents
+            node_ids = np.where(not_roots, grandparents, node_ids)
+
+    def _combine_clusters(self, node1_ids, node2_ids):
+        roots1, roots2 = self._get_roots(node1_ids), self._get_roots(node2_ids)
+        differ = roots1 != roots2
+        roots1, roots2 = roots1[differ], roots2[differ]
+
+        # union by size: smaller tree is attached to the root of bigger one
+        swap = self._cluster_sizes[roots1] < self._cluster_sizes[roots2]
+        roots1, roots2 = np.where(swap, roots2, roots1), np.where(swap, roots1, roots2)
+        self._parents[roots2] = roots1
+        self._cluster_sizes[roots1] += self._cluster_sizes[roots2]
+        self._root_sentinels[roots1] |= self._root_sentinels[roots2]
+
+    def _bond_nodes(self, bond_ids):
+        bonds_per_direction = self._size * (self._size - 1)
+        horizontal = bond_ids < bonds_per_direction
+        horizontal_nodes = (bond_ids // max(self._size - 1, 1)) * self._size + bond_ids % max(self._size - 1, 1)
+        vertical_nodes = bond_ids - bonds_per_direction
+        nodes1 = np.where(horizontal, horizontal_nodes, vertical_nodes)
+        nodes2 = nodes1 + np.where(horizontal, 1, self._size)
+        return nodes1, nodes2
+
+    def _activate_bonds(self, replicas, bond_ids):
+        nodes1, nodes2 = self._bond_nodes(bond_ids)
+        offsets = self._replica_offsets[replicas]
+        self._combine_clusters(nodes1 + offsets, nodes2 + offsets)
+        return self._get_roots(nodes1 + offsets)
+
+    def _activate_nodes(self, replicas, node_ids):
+        offsets = self._replica_offsets[replicas]
+        global_ids = node_ids + offsets
+        self._active_nodes[global_ids] = True
+        self._root_sentinels[global_ids] = self._node_sentinels[node_ids]
+
+        rows, cols = np.divmod(node_ids, self._size)
+        for in_bounds, displ in [(rows > 0, -self._size), (rows < self._size - 1, self._size),
+                                 (cols > 0, -1), (cols < self._size - 1, 1)]:
+            adjacent_ids = np.where(in_bounds, global_ids + displ, global_ids)
+            mask = in_bounds & self._active_nodes[adjacent_ids]
+            if mask.any():
+                self._combine_clusters(global_ids[mask], adjacent_ids[mask])
+        return self._get_roots(global_ids)
+
+    def run(self, criterion=Mesh.SPAN_VERTICAL):
+        # returns vector of R percollation thresholds (number of items activated when replica started to percollate)
+        thresholds = np.zeros(self._replicas_num, dtype=np.int64)
+        replicas = np.arange(self._replicas_num)
+
+        # without activated items only single node bond mesh percollates
+        if self._size == 1 and self._type == self.TYPE_BOND:
+            return thresholds
+
+        for step in range(1, self._activation_orders.shape[1] + 1):
+            items = self._activation_orders[replicas, step - 1]
+            if self._type == self.TYPE_BOND:
+                roots = self._activate_bonds(replicas, items)
+            else:
+                roots = self._activate_nodes(replicas, items)
+
+            # spanning can appear only in cluster of the last activated item
+            sentinels = self._root_sentinels[roots]
+            spans_vertically = (sentinels & Mesh.SENTINEL_TOP > 0) & (sentinels & Mesh.SENTINEL_BOTTOM > 0)
+            spans_horizontally = (sentinels & Mesh.SENTINEL_LEFT > 0) & (sentinels & Mesh.SENTINEL_RIGHT > 0)
+            finished = spanning_by_criterion(spans_vertically, spans_horizontally, criterion)
+
+            thresholds[replicas[finished]] = step
+            replicas = replicas[~finished]
+            if replicas.size == 0:
+                break
+
+        return thresholds
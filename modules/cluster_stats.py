@@ -0,0 +1,109 @@
+import numpy as np
+
+
+class ClusterStats:
+    # Clusters statistics maintained by mesh engines on every activation and union, so they can be queried at any
+    #   moment of the run without scanning nodes.
+    #
+    # Only sizes of joined clusters are needed: histogram n_s (number of clusters of size s) is a dict updated with
+    #   3 operations per union, sums of sizes and squared sizes are updated with it. Clusters only grow, so the
+    #   largest size is a running maximum. Every query is O(1), except histogram export (O(distinct sizes)).
+
+    def __init__(self, histogram=None):
+        # histogram - {size: clusters number} to start from
+        self._histogram = {}
+        self._clusters_number = 0
+        # sum of s * n_s (nodes in clusters) and of s^2 * n_s
+        self._sizes_sum = 0
+        self._squares_sum = 0
+        self._largest_cluster_size = 0
+        for size, count in (histogram or {}).items():
+            self.add(int(size), int(count))
+
+    @staticmethod
+    def from_sizes(sizes):
+        # statistics of clusters with given sizes (array)
+        sizes, counts = np.unique(np.asarray(sizes), return_counts=True)
+        return ClusterStats(dict(zip(sizes.tolist(), counts.tolist())))
+
+    def add(self, size, count=1):
+        # new clusters (e.g. activated node)
+        self._histogram[size] = self._histogram.get(size, 0) + count
+        self._clusters_number += count
+        self._sizes_sum += size * count
+        self._squares_sum += size * size * count
+        self._largest_cluster_size = max(self._largest_cluster_size, size)
+
+    def _remove(self, size):
+        count = self._histogram[size] - 1
+        if count:
+            self._histogram[size] = count
+        else:
+            del self._histogram[size]
+        self._clusters_number -= 1
+        self._sizes_sum -= size
+        self._squares_sum -= size * size
+
+    def merge(self, size1, size2):
+        # clusters of sizes size1 and size2 are joined
+        self._remove(size1)
+        self._remove(size2)
+        self.add(size1 + size2)
+
+    def get_clusters_number(self):
+        return self._clusters_number
+
+    def get_largest_cluster_size(self):
+        return self._largest_cluster_size
+
+    def get_mean_cluster_size(self):
+        # sum(s * n_s) / sum(n_s)
+        return self._sizes_sum / self._clusters_number if self._clusters_number else 0.
+
+    def get_susceptibility(self):
+        # mean size of cluster a random node belongs to, without the largest cluster:
+        #   sum'(s^2 * n_s) / sum'(s * n_s), it peaks at percollation threshold
+        sizes_sum = self._sizes_sum - self._largest_cluster_size
+        if sizes_sum <= 0:
+            return 0.
+        return (self._squares_sum - self._largest_cluster_size ** 2) / sizes_sum
+
+    def get_percollation_strength(self, nodes_number):
+        # fraction of mesh nodes in the largest cluster
+        return self._largest_cluster_size / nodes_number
+
+    def get_histogram(self):
+        # (sizes, clusters numbers) arrays sorted by size
+        sizes = np.array(sorted(self._histogram), dtype=np.int64)
+        return sizes, np.array([self._histogram[size] for size in sizes.tolist()], dtype=np.int64)
+
+    def export(self):
+        # [[size, clusters number], ..], can be stored as JSON and loaded with ClusterStats(dict(exported))
+        return [[size, count] for size, count in sorted(self._histogram.items())]
+
+
+class ClusterStatsSampler:
+    # Observer for main.conduct_experiment: records clusters statistics of the mesh every `every` activations,
+    #   e.g. for percollation strength and susceptibility curves of a run
+
+    FIELDS = ("activated", "clusters_number", "largest_cluster_size", "percollation_strength", "mean_cluster_size",
+              "susceptibility")
+
+    def __init__(self, every=1):
+        assert every > 0, "Sampling period should be > 0"
+        self._every = every
+        self._samples = []
+
+    def __call__(self, mesh):
+        activated = mesh.calculate_percollation()
+        if activated % self._every:
+            return
+        stats = mesh.get_cluster_stats()
+        self._samples.append((activated, stats.get_clusters_number(), stats.get_largest_cluster_size(),
+                              stats.get_percollation_strength(mesh.get_nodes_number()),
+                              stats.get_mean_cluster_size(), stats.get_susceptibility()))
+
+    def get_curves(self):
+        # {field: array of samples}
+        columns = list(zip(*self._samples)) if self._samples else [()] * len(self.FIELDS)
+        return {name: np.array(values) for name, values in zip(self.FIELDS, columns)}
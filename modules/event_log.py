@@ -0,0 +1,228 @@
+import bisect
+import json
+import os
+
+import numpy as np
+
+from modules.array_mesh import ArrayMesh
+from modules.lattices import make_lattice
+from modules.orders import index_dtype
+from modules.structures import Mesh
+
+ACTIVATION = 0
+MERGE = 1
+
+# events are written to disk in blocks of this size
+BUFFER_EVENTS = 2 ** 16
+# default number of snapshots per run (see EventLogWriter)
+SNAPSHOTS_NUM = 16
+
+
+def event_dtype(items_num):
+    # packed record of one event:
+    #   ACTIVATION - id is activated node/bond id, other_id and size are 0
+    #   MERGE - cluster with root other_id is attached to root id, size is the size of joined cluster
+    dtype = index_dtype(items_num)
+    return np.dtype([("kind", np.uint8), ("id", dtype), ("other_id", dtype), ("size", dtype)])
+
+
+class EventLogWriter:
+    # Compact binary log of ArrayMesh run: activation sequence and clusters merges (roots pair and joined cluster size).
+    #
+    # Log is a directory with:
+    #   meta.json - mesh size, type and lattice, events dtype, snapshots list
+    #   events.bin - packed event records (see event_dtype), ~13 bytes each for meshes up to 2^31 items
+    #   snapshot_<step>.npz - whole mesh state after <step> activations, every snapshot_every steps
+    #     (None - SNAPSHOTS_NUM snapshots per full run)
+    #
+    # Usage: mesh.set_event_log(EventLogWriter(path)), activate items, then close() the log.
+
+    def __init__(self, path, snapshot_every=None):
+        assert snapshot_every is None or snapshot_every > 0, "Snapshot period should be > 0"
+        self._path = path
+        self._snapshot_every = snapshot_every
+        self._mesh = None
+        self._meta = None
+        self._events_file = None
+        self._buffer = []
+        self._events_written = 0
+        self._steps = 0
+
+    def start(self, mesh: ArrayMesh):
+        # called by ArrayMesh.set_event_log
+        assert self._mesh is None, "Event log is already started"
+        os.makedirs(self._path, exist_ok=True)
+        self._mesh = mesh
+        items_num = mesh.get_items_number()
+        lattice = mesh.get_lattice()
+        if self._snapshot_every is None:
+            self._snapshot_every = max(1, items_num // SNAPSHOTS_NUM)
+        self._dtype = event_dtype(items_num)
+        self._meta = {
+            "size": mesh.get_size(),
+            "type": mesh.get_type(),
+            # None - square lattice without tables
+            "lattice": None if lattice is None else lattice.name,
+            # node activation merges new cluster with every adjacent one, bond activation - with 1
+            "max_events_per_step": 2 if mesh.get_type() == Mesh.TYPE_BOND else
+            1 + (4 if lattice is None else int(lattice.get_coordination_numbers().max(initial=0))),
+            "event_dtype": self._dtype.descr,
+            "snapshot_every": self._snapshot_every,
+            # [step, index of its first event]
+            "snapshots": [],
+            "steps": None,
+        }
+        self._events_file = open(os.path.join(self._path, "events.bin"), "wb")
+        self._steps = mesh.calculate_percollation()
+        self._snapshot()
+
+    def _events_number(self):
+        return self._events_written + len(self._buffer)
+
+    def _write_meta(self):
+        with open(os.path.join(self._path, "meta.json"), "w") as f:
+            json.dump(self._meta, f)
+
+    def _flush(self):
+        if self._buffer:
+            np.array(self._buffer, dtype=self._dtype).tofile(self._events_file)
+            self._events_written += len(self._buffer)
+            self._buffer = []
+        self._events_file.flush()
+
+    def _snapshot(self):
+        np.savez(os.path.join(self._path, "snapshot_{}.npz".format(self._steps)), **self._mesh.get_state())
+        self._flush()
+        self._meta["snapshots"].append([self._steps, self._events_number()])
+        self._write_meta()
+
+    def activation(self, item_id):
+        # state before activation is the state after self._steps activations
+        if self._steps % self._snapshot_every == 0 and self._meta["snapshots"][-1][0] != self._steps:
+            self._snapshot()
+        self._buffer.append((ACTIVATION, item_id, 0, 0))
+        self._steps += 1
+        if len(self._buffer) >= BUFFER_EVENTS:
+            self._flush()
+
+    def merge(self, root_id, absorbed_root_id, size):
+        self._buffer.append((MERGE, root_id, absorbed_root_id, size))
+
+    def close(self):
+        if self._meta["snapshots"][-1][0] != self._steps:
+            self._snapshot()
+        self._flush()
+        self._events_file.close()
+        self._meta["steps"] = self._steps
+        self._write_meta()
+        self._mesh.set_event_log(None)
+
+
+class EventLog:
+    # Reader of log written by EventLogWriter. Events file is memory mapped, so it is read at disk speed and only
+    #   the needed parts are loaded. state_at(step) loads the nearest snapshot before step and applies only events
+    #   after it, merges are applied by recorded roots without any root search.
+
+    def __init__(self, path):
+        self._path = path
+        with open(os.path.join(path, "meta.json")) as f:
+            self._meta = json.load(f)
+        self._dtype = np.dtype([tuple(field) for field in self._meta["event_dtype"]])
+        events_path = os.path.join(path, "events.bin")
+        if os.path.getsize(events_path) >= self._dtype.itemsize:
+            self._events = np.memmap(events_path, dtype=self._dtype, mode="r")
+        else:
+            self._events = np.zeros(0, dtype=self._dtype)
+        # log of unfinished run is read up to its last snapshot
+        self._snapshots = self._meta["snapshots"]
+        if self._meta["steps"] is None:
+            self._events = self._events[:self._snapshots[-1][1]]
+
+    def get_size(self):
+        return self._meta["size"]
+
+    def get_type(self):
+        return self._meta["type"]
+
+    def get_steps_number(self):
+        return self._snapshots[-1][0] if self._meta["steps"] is None else self._meta["steps"]
+
+    def get_events(self):
+        # all event records (memory mapped structured array)
+        return self._events
+
+    def get_activations(self):
+        # activated items ids in activation order
+        return self._events["id"][self._events["kind"] == ACTIVATION]
+
+    def _step_event_index(self, step, snapshot_step, snapshot_index):
+        # index of the first event after step activations, searched forward from snapshot
+        window_size = self._meta["max_events_per_step"] * (step - snapshot_step) + 1
+        window = self._events["kind"][snapshot_index:snapshot_index + window_size]
+        activations = np.flatnonzero(window == ACTIVATION)
+        if activations.size > step - snapshot_step:
+            return snapshot_index + int(activations[step - snapshot_step])
+        return snapshot_index + window.size
+
+    def _load_snapshot(self, step):
+        with np.load(os.path.join(self._path, "snapshot_{}.npz".format(step))) as data:
+            return {name: data[name] for name in data.files}
+
+    def _apply_events(self, mesh, state, events):
+        type = self.get_type()
+        activated = events["id"][events["kind"] == ACTIVATION]
+        merges = events[events["kind"] == MERGE]
+
+        # activations are applied first: node is not merged with anything before its activation
+        state["activated_items_number"] = int(state["activated_items_number"]) + activated.size
+        changed_roots = []
+        if type == Mesh.TYPE_BOND:
+            state["bonds"][activated] = True
+        else:
+            state["active_nodes"][activated] = True
+            state["root_sentinels"][activated] = mesh.get_nodes_sentinels(activated)
+            state["clusters_number"] = int(state["clusters_number"]) + activated.size
+            if activated.size:
+                state["largest_cluster_size"] = max(int(state["largest_cluster_size"]), 1)
+            changed_roots.append(activated)
+
+        parents, cluster_sizes, sentinels = state["parents"], state["cluster_sizes"], state["root_sentinels"]
+        for root_id, absorbed_root_id, size in zip(merges["id"].tolist(), merges["other_id"].tolist(),
+                                                   merges["size"].tolist()):
+            parents[absorbed_root_id] = root_id
+            cluster_sizes[root_id] = size
+            sentinels[root_id] |= sentinels[absorbed_root_id]
+        state["clusters_number"] = int(state["clusters_number"]) - merges.size
+        if merges.size:
+            state["largest_cluster_size"] = max(int(state["largest_cluster_size"]), int(merges["size"].max()))
+            changed_roots.append(merges["id"])
+
+        # sentinels of roots only grow, so their final masks show every spanning reached in between
+        if changed_roots:
+            masks = sentinels[np.concatenate(changed_roots)]
+            vertical = Mesh.SENTINEL_TOP | Mesh.SENTINEL_BOTTOM
+            horizontal = Mesh.SENTINEL_LEFT | Mesh.SENTINEL_RIGHT
+            state["spans_vertically"] = bool(state["spans_vertically"]) or bool(np.any(masks & vertical == vertical))
+            state["spans_horizontally"] = (bool(state["spans_horizontally"])
+                                           or bool(np.any(masks & horizontal == horizontal)))
+
+    def _remaining_items(self, start_index):
+        for start in range(start_index, self._events.size, BUFFER_EVENTS):
+            events = self._events[start:start + BUFFER_EVENTS]
+            yield from events["id"][events["kind"] == ACTIVATION].tolist()
+
+    def state_at(self, step):
+        # ArrayMesh in state after step activations. Its next activations follow the recorded sequence
+        assert 0 <= step <= self.get_steps_number(), "Step is out of recorded range"
+        snapshot_ind = bisect.bisect_right([snapshot_step for snapshot_step, _ in self._snapshots], step) - 1
+        snapshot_step, snapshot_index = self._snapshots[snapshot_ind]
+
+        lattice = None if self._meta["lattice"] is None else make_lattice(self._meta["lattice"], self.get_size())
+        mesh = ArrayMesh(self.get_size(), self.get_type(), lazy_order=True, lattice=lattice)
+        state = self._load_snapshot(snapshot_step)
+        end_index = self._step_event_index(step, snapshot_step, snapshot_index)
+        self._apply_events(mesh, state, self._events[snapshot_index:end_index])
+
+        mesh.set_state(state)
+        mesh.set_activation_order(self._remaining_items(end_index))
+        return mesh
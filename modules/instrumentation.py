@@ -0,0 +1,68 @@
+import time
+from contextlib import contextmanager, nullcontext
+
+_NO_PHASE = nullcontext()
+
+
+class Counters:
+    # Hot path counters of one or several experiments.
+    #
+    # Mesh engines keep reference to Counters object (or None) and update it only if it is set, so disabled
+    #   instrumentation costs one "is not None" check per operation.
+    #
+    # find_calls, find_path_length - root searches and total number of parent links followed by them
+    # compressions - nodes re-linked closer to root (path compression / halving)
+    # unions - clusters merges
+    # spanning_checks - check_percollation calls
+    # wasted_activations - activation draws which changed nothing (not existing or already active bonds)
+
+    FIELDS = ("find_calls", "find_path_length", "compressions", "unions", "spanning_checks", "wasted_activations")
+
+    def __init__(self):
+        self.counters = dict.fromkeys(self.FIELDS, 0)
+        # phase name -> seconds
+        self.phase_times = {}
+
+    def add(self, name, value=1):
+        self.counters[name] += value
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phase_times[name] = self.phase_times.get(name, 0.) + time.perf_counter() - start
+
+    def add_phase_time(self, name, seconds):
+        self.phase_times[name] = self.phase_times.get(name, 0.) + seconds
+
+    def export(self):
+        # plain dict, can be sent between processes and stored as JSON
+        return {"counters": dict(self.counters), "phase_times": dict(self.phase_times)}
+
+    @staticmethod
+    def merge(exports):
+        # sum of exported counters (e.g. of all experiments done by pool workers)
+        total = Counters()
+        for exported in exports:
+            for name, value in exported["counters"].items():
+                total.counters[name] = total.counters.get(name, 0) + value
+            for name, seconds in exported["phase_times"].items():
+                total.add_phase_time(name, seconds)
+        return total
+
+    def report(self):
+        lines = ["{}: {}".format(name, value) for name, value in self.counters.items()]
+        if self.counters["find_calls"]:
+            lines.append("mean find path length: {:.3f}".format(
+                self.counters["find_path_length"] / self.counters["find_calls"]))
+        total_time = sum(self.phase_times.values())
+        for name, seconds in sorted(self.phase_times.items(), key=lambda item: -item[1]):
+            lines.append("phase {}: {:.3f}s ({:.1%})".format(name, seconds, seconds / total_time if total_time else 0))
+        return "\n".join(lines)
+
+
+def phase(stats, name):
+    # stats.phase(name) or reusable no-op context if instrumentation is disabled (stats is None)
+    return _NO_PHASE if stats is None else stats.phase(name)
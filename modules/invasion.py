@@ -0,0 +1,231 @@
+import heapq
+
+import numpy as np
+from modules.structures import Mesh, SEED, spanning_by_criterion
+from modules.lattices import square
+
+
+class InvasionMesh:
+    _size = None
+    _type = None
+    _lattice = None
+
+    # random strength of every node (site invasion) or bond (bond invasion)
+    _strengths = None
+    _invaded_nodes = None
+    _invaded_bonds = None
+    # items pushed to the growth front (every item is pushed once)
+    _in_front = None
+    # binary heap of (strength, item id) of items on the perimeter of invaded cluster
+    _front = None
+    # sentinels (Mesh.SENTINEL_*) of invaded cluster
+    _sentinels = 0
+    _activated_items_number = 0
+
+    # trapping invasion: remaining nodes of precomputed invasion order
+    _trapping_order = None
+
+    TYPE_INVASION_NODE = Mesh.TYPE_INVASION_NODE
+    TYPE_INVASION_BOND = Mesh.TYPE_INVASION_BOND
+
+    # Invasion percollation (https://doi.org/10.1088/0305-4470/16/14/028).
+    #
+    # Every node (site invasion) or bond (bond invasion) gets random strength. Invader starts from the top row (inlet)
+    #   and on every step invades the perimeter item with the lowest strength, so invaded cluster is always connected.
+    #   Perimeter is a binary heap, every item is pushed once when cluster reaches it, so run over N items is
+    #   O(N log N). Perimeter of bond invasion is bonds between invaded and not invaded nodes, bond is invaded with
+    #   its far node (so invaded bonds grow a minimum spanning tree like Prim's algorithm).
+    #
+    # Spanning is tracked with sentinels of invaded cluster like in Mesh: cluster spans vertically when it reaches
+    #   the bottom row (outlet) and horizontally from the start.
+    #
+    # With trapping (site invasion only) defender can't be displaced from regions enclosed by invader, i.e. not
+    #   connected to the outlet by not invaded nodes. Invasion without trapping is run to breakthrough (the outlet is
+    #   reached) first, then trapped nodes are found going back in time with union-find over defender nodes
+    #   (https://doi.org/10.1088/0305-4470/32/49/101): node invaded at step t was trapped if its defender cluster
+    #   right before t is not connected to the outlet. Trapped regions don't change perimeter of the rest, so trapping
+    #   invasion is the same order without trapped nodes
+
+    def __init__(self, side_size: int, type: int, seed=None, stats=None, lattice=None, trapping=False):
+        assert type == self.TYPE_INVASION_NODE or type == self.TYPE_INVASION_BOND, "Unacceptable mesh type"
+        assert side_size > 0, "Unacceptable mesh side size"
+        assert not trapping or type == self.TYPE_INVASION_NODE, "Trapping is supported for site invasion only"
+        self._type = type
+        self._size = side_size
+        # instrumentation.Counters of hot paths or None (disabled)
+        self._stats = stats
+        self._lattice = square(side_size) if lattice is None else lattice
+        assert self._lattice.side_size == side_size, "Lattice of other side size"
+
+        items_num = self._lattice.nodes_num if type == self.TYPE_INVASION_NODE else self._lattice.bonds_num
+        rng = np.random.default_rng(SEED if seed is None else seed)
+        self._strengths = rng.random(items_num)
+        # top row (top face of 3-D lattice)
+        self._inlet = np.flatnonzero(self._lattice.node_sentinels & Mesh.SENTINEL_TOP).tolist()
+        self._reset()
+        if trapping:
+            order = self._run_to_breakthrough()
+            trapped = self._trapped_nodes(order)
+            self._reset()
+            self._trapping_order = iter([node_id for node_id in order if not trapped[node_id]])
+
+    def _reset(self):
+        nodes_num = self._lattice.nodes_num
+        self._invaded_nodes = np.zeros(nodes_num, dtype=bool)
+        if self._type == self.TYPE_INVASION_BOND:
+            self._invaded_bonds = np.zeros(self._lattice.bonds_num, dtype=bool)
+        self._in_front = np.zeros(self._strengths.size, dtype=bool)
+        self._front = []
+        self._sentinels = 0
+        self._activated_items_number = 0
+        # the whole inlet is invaded before the front is built, so inlet nodes never get to the front
+        self._invaded_nodes[self._inlet] = True
+        for node_id in self._inlet:
+            self._invade_node(node_id)
+
+    def _invade_node(self, node_id):
+        self._invaded_nodes[node_id] = True
+        self._sentinels |= int(self._lattice.node_sentinels[node_id])
+        offsets = self._lattice.neighbour_offsets
+        start, stop = int(offsets[node_id]), int(offsets[node_id + 1])
+        neighbours = self._lattice.neighbours[start:stop].tolist()
+        items = neighbours
+        if self._type == self.TYPE_INVASION_BOND:
+            items = self._lattice.neighbour_bonds[start:stop].tolist()
+        for item, adjacent_id in zip(items, neighbours):
+            if self._invaded_nodes[adjacent_id]:
+                continue
+            if not self._in_front[item]:
+                self._in_front[item] = True
+                heapq.heappush(self._front, (self._strengths[item], item))
+
+    def _invade_next_item(self):
+        # invades the weakest perimeter item, returns its id (None - nothing to invade)
+        while self._front:
+            _, item = heapq.heappop(self._front)
+            if self._type == self.TYPE_INVASION_NODE:
+                self._activated_items_number += 1
+                self._invade_node(item)
+                return item
+            node1_id, node2_id = self._lattice.bond_nodes[item].tolist()
+            # bond whose both nodes were invaded through other bonds is not on the perimeter anymore
+            if self._invaded_nodes[node1_id] and self._invaded_nodes[node2_id]:
+                continue
+            self._activated_items_number += 1
+            self._invaded_bonds[item] = True
+            self._invade_node(node2_id if self._invaded_nodes[node1_id] else node1_id)
+            return item
+        return None
+
+    def _reaches_outlet(self):
+        return self._sentinels & Mesh.SENTINEL_BOTTOM > 0
+
+    def _run_to_breakthrough(self):
+        # invaded nodes in order of invasion without trapping, until the outlet is reached
+        order = []
+        while not self._reaches_outlet():
+            node_id = self._invade_next_item()
+            if node_id is None:
+                break
+            order.append(node_id)
+        return order
+
+    def _trapped_nodes(self, order):
+        # boolean array of nodes which would be trapped when invaded in order (see class comment)
+        nodes_num = self._lattice.nodes_num
+        outlet = nodes_num
+        # union-find over defender nodes and virtual outlet node
+        parents = list(range(nodes_num + 1))
+
+        def find(node_id):
+            while parents[node_id] != node_id:
+                parents[node_id] = parents[parents[node_id]]
+                node_id = parents[node_id]
+            return node_id
+
+        defender = (~self._invaded_nodes).tolist()
+        bottom = (self._lattice.node_sentinels & Mesh.SENTINEL_BOTTOM > 0).tolist()
+
+        def add_defender(node_id):
+            defender[node_id] = True
+            if bottom[node_id]:
+                parents[find(node_id)] = find(outlet)
+            for adjacent_id in self._lattice.get_neighbours(node_id):
+                if defender[adjacent_id]:
+                    parents[find(adjacent_id)] = find(node_id)
+
+        for node_id in np.flatnonzero(defender).tolist():
+            add_defender(node_id)
+        trapped = np.zeros(nodes_num, dtype=bool)
+        for node_id in reversed(order):
+            add_defender(node_id)
+            trapped[node_id] = find(node_id) != find(outlet)
+        return trapped
+
+    def _invade_next(self):
+        if self._trapping_order is None:
+            return self._invade_next_item()
+        node_id = next(self._trapping_order, None)
+        if node_id is not None:
+            self._activated_items_number += 1
+            self._invade_node(node_id)
+        return node_id
+
+    def invade_next(self):
+        # one invasion step, returns {"invaded": item id} or None if nothing can be invaded anymore
+        item = self._invade_next()
+        if item is None:
+            return None
+        return {"invaded": item}
+
+    def check_percollation(self, criterion=Mesh.SPAN_VERTICAL):
+        if self._stats is not None:
+            self._stats.add("spanning_checks")
+        vertical = Mesh.SENTINEL_TOP | Mesh.SENTINEL_BOTTOM
+        horizontal = Mesh.SENTINEL_LEFT | Mesh.SENTINEL_RIGHT
+        return spanning_by_criterion(self._sentinels & vertical == vertical,
+                                     self._sentinels & horizontal == horizontal, criterion)
+
+    def calculate_percollation(self):
+        # number of invaded items (nodes or bonds), inlet nodes are not counted
+        return self._activated_items_number
+
+    def get_size(self):
+        return self._size
+
+    def get_type(self):
+        return self._type
+
+    def get_lattice(self):
+        return self._lattice
+
+    def get_nodes_number(self):
+        return self._lattice.nodes_num
+
+    def get_items_number(self):
+        return self._strengths.size
+
+    def get_strengths(self):
+        return self._strengths
+
+    def get_invaded_nodes(self):
+        return self._invaded_nodes.copy()
+
+    def get_invaded_bonds(self):
+        # None in site invasion
+        return None if self._invaded_bonds is None else self._invaded_bonds.copy()
+
+    def get_root_ids(self):
+        # invaded nodes are one cluster with the first inlet node as root, others are single nodes
+        roots = np.arange(self._lattice.nodes_num)
+        roots[self._invaded_nodes] = self._inlet[0]
+        return roots
+
+    def get_present_nodes(self):
+        return self._invaded_nodes.copy()
+
+    def get_roots_sentinels(self, root_ids):
+        root_ids = np.asarray(root_ids)
+        sentinels = np.zeros(root_ids.shape, dtype=np.uint8)
+        sentinels[self._invaded_nodes[root_ids]] = self._sentinels
+        return sentinels
@@ -0,0 +1,151 @@
+import numpy as np
+
+from modules.lattices import SENTINEL_TOP, SENTINEL_BOTTOM, SENTINEL_LEFT, SENTINEL_RIGHT
+from modules.structures import Mesh
+
+# Numba is optional: without it kernels are plain python functions and ArrayMesh uses its own per-item methods
+try:
+    import numba
+except ImportError:
+    numba = None
+
+JIT_AVAILABLE = numba is not None
+
+# counters array of activate_sequence (in-out)
+COUNTER_ACTIVATED = 0
+COUNTER_CLUSTERS = 1
+COUNTER_LARGEST = 2
+COUNTER_SPANS_VERTICALLY = 3
+COUNTER_SPANS_HORIZONTALLY = 4
+COUNTERS_NUM = 5
+
+SPAN_VERTICAL = Mesh.SPAN_VERTICAL
+SPAN_HORIZONTAL = Mesh.SPAN_HORIZONTAL
+SPAN_EITHER = Mesh.SPAN_EITHER
+
+
+def jit(function):
+    # compiled function (cached on disk) or the function itself when Numba is not installed
+    if numba is None:
+        return function
+    return numba.njit(cache=True)(function)
+
+
+# Union-find kernel of ArrayMesh: the whole activate-and-union loop over a block of activation sequence in one call.
+#
+# It repeats ArrayMesh step by step: the same root search with path halving, the same union by size (root of the
+#   first node is kept on equal sizes), the same neighbours order and spanning rules, so arrays and counters after
+#   it are bit-identical to per-item activation, compiled or not. Only integer arrays and scalars are used, so Numba
+#   compiles it in nopython mode. Square lattice without tables computes bonds, neighbours and sentinels
+#   arithmetically like ArrayMesh, lattices.Lattice tables are passed otherwise (empty arrays for square lattice).
+
+
+@jit
+def _get_root(parents, node_id):
+    parent = parents[node_id]
+    while parent != node_id:
+        grandparent = parents[parent]
+        parents[node_id] = grandparent
+        node_id = grandparent
+        parent = parents[node_id]
+    return node_id
+
+
+@jit
+def _combine_clusters(parents, cluster_sizes, root_sentinels, counters, node1_id, node2_id):
+    root1, root2 = _get_root(parents, node1_id), _get_root(parents, node2_id)
+    if root1 == root2:
+        return
+    if cluster_sizes[root1] < cluster_sizes[root2]:
+        root1, root2 = root2, root1
+    parents[root2] = root1
+    cluster_sizes[root1] += cluster_sizes[root2]
+    counters[COUNTER_CLUSTERS] -= 1
+    counters[COUNTER_LARGEST] = max(counters[COUNTER_LARGEST], cluster_sizes[root1])
+    root_sentinels[root1] |= root_sentinels[root2]
+    _update_spanning(counters, root_sentinels[root1])
+
+
+@jit
+def _update_spanning(counters, sentinels):
+    if sentinels & SENTINEL_TOP and sentinels & SENTINEL_BOTTOM:
+        counters[COUNTER_SPANS_VERTICALLY] = 1
+    if sentinels & SENTINEL_LEFT and sentinels & SENTINEL_RIGHT:
+        counters[COUNTER_SPANS_HORIZONTALLY] = 1
+
+
+@jit
+def _spans(counters, criterion):
+    vertically = counters[COUNTER_SPANS_VERTICALLY] != 0
+    horizontally = counters[COUNTER_SPANS_HORIZONTALLY] != 0
+    if criterion == SPAN_VERTICAL:
+        return vertically
+    if criterion == SPAN_HORIZONTAL:
+        return horizontally
+    if criterion == SPAN_EITHER:
+        return vertically or horizontally
+    return vertically and horizontally
+
+
+@jit
+def activate_sequence(items, node_model, criterion, size, use_lattice, bond_nodes, neighbour_offsets, neighbours,
+                      node_sentinels, parents, cluster_sizes, root_sentinels, active, counters):
+    # activates items (bonds or nodes ids) one by one until percollation by criterion, returns number of items taken.
+    #   active - bonds flags (bond model) or active nodes flags (node model),
+    #   counters - int64 array of COUNTER_* values, updated in place
+    taken = 0
+    for item in items:
+        if _spans(counters, criterion):
+            break
+        taken += 1
+        if not node_model:
+            if active[item]:
+                continue
+            active[item] = True
+            counters[COUNTER_ACTIVATED] += 1
+            if use_lattice:
+                node1_id, node2_id = bond_nodes[item, 0], bond_nodes[item, 1]
+            elif item < size * (size - 1):
+                node1_id = (item // (size - 1)) * size + item % (size - 1)
+                node2_id = node1_id + 1
+            else:
+                node1_id = item - size * (size - 1)
+                node2_id = node1_id + size
+            _combine_clusters(parents, cluster_sizes, root_sentinels, counters, node1_id, node2_id)
+            continue
+
+        active[item] = True
+        counters[COUNTER_ACTIVATED] += 1
+        counters[COUNTER_CLUSTERS] += 1
+        counters[COUNTER_LARGEST] = max(counters[COUNTER_LARGEST], 1)
+        if use_lattice:
+            sentinels = node_sentinels[item]
+            root_sentinels[item] = sentinels
+            _update_spanning(counters, sentinels)
+            for position in range(neighbour_offsets[item], neighbour_offsets[item + 1]):
+                adjacent_id = neighbours[position]
+                if active[adjacent_id]:
+                    _combine_clusters(parents, cluster_sizes, root_sentinels, counters, item, adjacent_id)
+            continue
+
+        # the same sentinels and neighbours order as ArrayMesh (up, down, left, right)
+        row_ind, col_ind = item // size, item % size
+        sentinels = ((row_ind == 0) * SENTINEL_TOP | (row_ind == size - 1) * SENTINEL_BOTTOM |
+                     (col_ind == 0) * SENTINEL_LEFT | (col_ind == size - 1) * SENTINEL_RIGHT)
+        root_sentinels[item] = sentinels
+        _update_spanning(counters, sentinels)
+        if row_ind > 0 and active[item - size]:
+            _combine_clusters(parents, cluster_sizes, root_sentinels, counters, item, item - size)
+        if row_ind < size - 1 and active[item + size]:
+            _combine_clusters(parents, cluster_sizes, root_sentinels, counters, item, item + size)
+        if col_ind > 0 and active[item - 1]:
+            _combine_clusters(parents, cluster_sizes, root_sentinels, counters, item, item - 1)
+        if col_ind < size - 1 and active[item + 1]:
+            _combine_clusters(parents, cluster_sizes, root_sentinels, counters, item, item + 1)
+    return taken
+
+
+def empty_tables():
+    # placeholders of lattice tables for square lattice (Numba needs arrays of fixed types)
+    return np.zeros((0, 2), dtype=np.int64), np.zeros(1, dtype=np.int64), np.zeros(0, dtype=np.int64), \
+        np.zeros(0, dtype=np.uint8)
@@ -0,0 +1,127 @@
+import numpy as np
+from modules.structures import Mesh, SEED, spanning_by_criterion
+
+
+# Cluster labeling of k*k meshes with fixed occupation probability p (no activation sequence).
+#
+# Whole occupancy (nodes or horizontal/vertical bonds) of a batch of samples is drawn at once and clusters are
+# labeled with Hoshen-Kopelman pass row by row: runs of connected nodes inside a row get provisional labels, then
+# labels of the row are merged with labels of the previous row through occupied vertical connections.
+# Every row is processed for all samples at once, labels equivalences are kept in one union-find array.
+
+
+def _draw_occupancy(side_size, p, mesh_type, samples_num, rng):
+    # returns present nodes (B, k, k), horizontal connections (B, k, k-1) and vertical connections (B, k-1, k)
+    shape = (samples_num, side_size, side_size)
+    if mesh_type == Mesh.TYPE_NODE:
+        nodes = rng.random(shape) < p
+        horizontal = nodes[:, :, :-1] & nodes[:, :, 1:]
+        vertical = nodes[:, :-1, :] & nodes[:, 1:, :]
+    else:
+        nodes = np.ones(shape, dtype=bool)
+        horizontal = rng.random((samples_num, side_size, side_size - 1)) < p
+        vertical = rng.random((samples_num, side_size - 1, side_size)) < p
+    return nodes, horizontal, vertical
+
+
+def _find_labels(parents, labels):
+    # vectorized root search with full path compression of visited labels
+    roots = parents[labels]
+    while True:
+        next_roots = parents[roots]
+        if np.array_equal(next_roots, roots):
+            break
+        roots = next_roots
+    parents[labels] = roots
+    return roots
+
+
+def _union_labels(parents, labels1, labels2):
+    # merges pairs of labels, smaller label becomes root. Repeated until all pairs share root,
+    #   because several pairs may point to the same root in one pass
+    while labels1.size:
+        roots1, roots2 = _find_labels(parents, labels1), _find_labels(parents, labels2)
+        differ = roots1 != roots2
+        if not differ.any():
+            return
+        roots1, roots2, labels1, labels2 = roots1[differ], roots2[differ], labels1[differ], labels2[differ]
+        np.minimum.at(parents, np.maximum(roots1, roots2), np.minimum(roots1, roots2))
+
+
+def _hoshen_kopelman(nodes, horizontal, vertical):
+    # returns labels (B, k, k) (0 for absent nodes, clusters are labeled by their smallest label)
+    #   and sample index of every label
+    samples_num, side_size, _ = nodes.shape
+    labels = np.zeros(nodes.shape, dtype=np.int64)
+    # label 0 - absent node. There are no more labels than nodes
+    parents = np.arange(nodes.size + 1, dtype=np.int64)
+    label_samples = np.zeros(nodes.size + 1, dtype=np.int64)
+    next_label = 1
+
+    for row in range(side_size):
+        row_nodes = nodes[:, row, :]
+        # new run of connected nodes starts at every present node not connected to its left neighbour
+        run_starts = row_nodes.copy()
+        run_starts[:, 1:] &= ~horizontal[:, row, :]
+        run_ids = np.cumsum(run_starts.ravel()).reshape(row_nodes.shape)
+        labels[:, row, :] = np.where(row_nodes, run_ids + (next_label - 1), 0)
+
+        runs_per_sample = run_starts.sum(axis=1)
+        runs_num = int(runs_per_sample.sum())
+        label_samples[next_label:next_label + runs_num] = np.repeat(np.arange(samples_num), runs_per_sample)
+        next_label += runs_num
+
+        if row > 0:
+            connected = vertical[:, row - 1, :]
+            _union_labels(parents, labels[:, row - 1, :][connected], labels[:, row, :][connected])
+
+    roots = _find_labels(parents[:next_label], np.arange(next_label))
+    return roots[labels], label_samples[:next_label]
+
+
+def label_clusters(side_size, p, mesh_type, samples_num=1, criterion=Mesh.SPAN_VERTICAL, seed=SEED):
+    assert mesh_type == Mesh.TYPE_BOND or mesh_type == Mesh.TYPE_NODE, "Unacceptable mesh type"
+    assert side_size > 0, "Unacceptable mesh side size"
+    assert 0 <= p <= 1, "Probability should be in [0; 1]"
+
+    rng = np.random.default_rng(seed)
+    nodes, horizontal, vertical = _draw_occupancy(side_size, p, mesh_type, samples_num, rng)
+    labels, label_samples = _hoshen_kopelman(nodes, horizontal, vertical)
+
+    # labels are unique over the whole batch, so all samples are processed at once
+    labels_num = label_samples.size
+    sizes = np.bincount(labels.ravel(), minlength=labels_num)
+    sizes[0] = 0
+    cluster_labels = np.flatnonzero(sizes)
+    # grouping clusters by sample (labels are given row by row for all samples, so they are interleaved)
+    cluster_labels = cluster_labels[np.argsort(label_samples[cluster_labels], kind="stable")]
+    cluster_samples = label_samples[cluster_labels]
+    cluster_sizes = sizes[cluster_labels]
+
+    def spanning_samples(side1, side2):
+        # samples with some cluster touching both sides of mesh
+        on_side1 = np.zeros(labels_num, dtype=bool)
+        on_side2 = np.zeros(labels_num, dtype=bool)
+        on_side1[side1.ravel()] = True
+        on_side2[side2.ravel()] = True
+        on_side1[0] = False
+        spans = np.zeros(samples_num, dtype=bool)
+        spans[label_samples[on_side1 & on_side2]] = True
+        return spans
+
+    spans_vertically = spanning_samples(labels[:, 0, :], labels[:, -1, :])
+    spans_horizontally = spanning_samples(labels[:, :, 0], labels[:, :, -1])
+
+    clusters_number = np.bincount(cluster_samples, minlength=samples_num)
+    largest_cluster_size = np.zeros(samples_num, dtype=np.int64)
+    np.maximum.at(largest_cluster_size, cluster_samples, cluster_sizes)
+
+    return {
+        "spans": spanning_by_criterion(spans_vertically, spans_horizontally, criterion),
+        "clusters_number": clusters_number,
+        "largest_cluster_size": largest_cluster_size,
+        # sizes of clusters of sample i are cluster_sizes[sizes_offsets[i]:sizes_offsets[i + 1]]
+        "cluster_sizes": cluster_sizes,
+        "sizes_offsets": np.concatenate(([0], np.cumsum(clusters_number))),
+        "labels": labels,
+    }
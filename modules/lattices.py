@@ -0,0 +1,139 @@
+import numpy as np
+
+from modules.orders import index_dtype
+
+# sentinel bits of nodes on the mesh sides (see structures.Mesh)
+SENTINEL_TOP = 1
+SENTINEL_BOTTOM = 2
+SENTINEL_LEFT = 4
+SENTINEL_RIGHT = 8
+
+
+class Lattice:
+    # Lattice geometry as precomputed tables, so engines look neighbours up with array indexing only.
+    #
+    # Nodes are numbered row by row (layer by layer for 3-D lattices), node i is in column i % k.
+    #   bond_nodes - (bonds_num, 2) nodes pairs of all bonds, bond id is row index
+    #   neighbour_offsets, neighbours, neighbour_bonds - CSR adjacency: neighbours of node i and bonds leading to them
+    #     are neighbours[neighbour_offsets[i]:neighbour_offsets[i + 1]] and the same slice of neighbour_bonds
+    #   node_sentinels - SENTINEL_* bits of sides every node lies on (rows are up-to-down, columns are left-to-right)
+
+    name = None
+    side_size = None
+    nodes_num = None
+    bonds_num = None
+
+    bond_nodes = None
+    neighbour_offsets = None
+    neighbours = None
+    neighbour_bonds = None
+    node_sentinels = None
+
+    def __init__(self, name, side_size, nodes_num, bond_nodes, node_sentinels):
+        self.name = name
+        self.side_size = side_size
+        self.nodes_num = nodes_num
+        self.bonds_num = len(bond_nodes)
+        dtype = index_dtype(max(nodes_num, 2 * self.bonds_num))
+        self.bond_nodes = bond_nodes.astype(dtype)
+        self.node_sentinels = node_sentinels.astype(np.uint8)
+
+        bond_ids = np.arange(self.bonds_num, dtype=dtype)
+        nodes = np.concatenate([self.bond_nodes[:, 0], self.bond_nodes[:, 1]])
+        order = np.argsort(nodes, kind="stable")
+        self.neighbours = np.concatenate([self.bond_nodes[:, 1], self.bond_nodes[:, 0]])[order]
+        self.neighbour_bonds = np.concatenate([bond_ids, bond_ids])[order]
+        self.neighbour_offsets = np.zeros(nodes_num + 1, dtype=dtype)
+        np.cumsum(np.bincount(nodes, minlength=nodes_num), out=self.neighbour_offsets[1:])
+
+    def get_neighbours(self, node_id):
+        # neighbours ids of the node (python ints)
+        return self.neighbours[self.neighbour_offsets[node_id]:self.neighbour_offsets[node_id + 1]].tolist()
+
+    def get_coordination_numbers(self):
+        return np.diff(self.neighbour_offsets)
+
+
+def grid_sentinels(rows, cols, rows_num, cols_num):
+    # sentinel bits of nodes in given rows and columns of rows_num x cols_num grid (arrays or ints)
+    rows, cols = np.asarray(rows), np.asarray(cols)
+    return ((rows == 0) * SENTINEL_TOP | (rows == rows_num - 1) * SENTINEL_BOTTOM |
+            (cols == 0) * SENTINEL_LEFT | (cols == cols_num - 1) * SENTINEL_RIGHT).astype(np.uint8)
+
+
+def _grid(side_size):
+    # (rows, columns) of all nodes of k x k grid
+    rows, cols = np.divmod(np.arange(side_size ** 2), side_size)
+    return rows, cols
+
+
+def _grid_bonds(side_size, steps):
+    # bonds from every node (row, col) to (row + step_row, col + step_col) inside the grid, one group per step
+    rows, cols = _grid(side_size)
+    groups = []
+    for step_row, step_col in steps:
+        to_rows, to_cols = rows + step_row, cols + step_col
+        inside = (to_rows >= 0) & (to_rows < side_size) & (to_cols >= 0) & (to_cols < side_size)
+        groups.append(np.stack([(rows * side_size + cols)[inside], (to_rows * side_size + to_cols)[inside]], axis=1))
+    return np.concatenate(groups)
+
+
+def _grid_lattice(name, side_size, steps):
+    rows, cols = _grid(side_size)
+    return Lattice(name, side_size, side_size ** 2, _grid_bonds(side_size, steps),
+                   grid_sentinels(rows, cols, side_size, side_size))
+
+
+def square(side_size):
+    # 4 neighbours. Horizontal bonds go first, then vertical ones, so bond ids are the same as in Mesh and ArrayMesh
+    return _grid_lattice("SQUARE", side_size, [(0, 1), (1, 0)])
+
+
+def triangular(side_size):
+    # 6 neighbours: square lattice with one diagonal in every cell (sheared triangular lattice)
+    return _grid_lattice("TRIANGULAR", side_size, [(0, 1), (1, 0), (1, 1)])
+
+
+def square_nnn(side_size):
+    # 8 neighbours: square lattice with nearest and next nearest (both diagonals) neighbours
+    return _grid_lattice("SQUARE_NNN", side_size, [(0, 1), (1, 0), (1, 1), (1, -1)])
+
+
+def honeycomb(side_size):
+    # 3 neighbours: brick wall lattice, square lattice where vertical bond goes down only from nodes with even
+    #   row + column
+    rows, cols = _grid(side_size)
+    bonds = _grid_bonds(side_size, [(0, 1), (1, 0)])
+    horizontal_num = side_size * (side_size - 1)
+    from_rows, from_cols = np.divmod(bonds[:, 0], side_size)
+    keep = (np.arange(len(bonds)) < horizontal_num) | ((from_rows + from_cols) % 2 == 0)
+    return Lattice("HONEYCOMB", side_size, side_size ** 2, bonds[keep],
+                   grid_sentinels(rows, cols, side_size, side_size))
+
+
+def simple_cubic(side_size):
+    # 6 neighbours, k x k x k nodes. Node id is (layer * k + row) * k + column, sides of rows and columns are the
+    #   mesh sides, so percollation criteria are the same as for 2-D lattices
+    layers, rest = np.divmod(np.arange(side_size ** 3), side_size ** 2)
+    rows, cols = np.divmod(rest, side_size)
+    node_ids = np.arange(side_size ** 3)
+    groups = []
+    for coords, step in [(cols, 1), (rows, side_size), (layers, side_size ** 2)]:
+        inside = coords < side_size - 1
+        groups.append(np.stack([node_ids[inside], node_ids[inside] + step], axis=1))
+    return Lattice("CUBIC", side_size, side_size ** 3, np.concatenate(groups),
+                   grid_sentinels(rows, cols, side_size, side_size))
+
+
+LATTICES = {
+    "SQUARE": square,
+    "TRIANGULAR": triangular,
+    "HONEYCOMB": honeycomb,
+    "SQUARE_NNN": square_nnn,
+    "CUBIC": simple_cubic,
+}
+
+
+def make_lattice(name, side_size):
+    assert name in LATTICES, "Unknown lattice: {}".format(name)
+    return LATTICES[name](side_size)
@@ -0,0 +1,103 @@
+import numpy as np
+from modules.structures import Mesh
+from modules.array_mesh import ArrayMesh
+
+
+# Newman-Ziff algorithm (https://arxiv.org/abs/cond-mat/0005264).
+#
+# One replica activates all items of the mesh in its random activation order and records observables after every
+#   activation, i.e. for every occupation number n in [0; N] (microcanonical ensemble). Curves for any occupation
+#   probability p are then obtained by convolution with binomial distribution (canonical ensemble):
+#   Q(p) = sum_n C(N, n) * p^n * (1-p)^(N-n) * Q_n
+
+OBSERVABLES = ("spans", "largest_cluster_size", "clusters_number", "mean_cluster_size", "susceptibility")
+
+
+# periodic - torus mesh, spans is then wrapping by criterion
+# seed - seed of activation order (None - random)
+def sweep(side_size, mesh_type, criterion=Mesh.SPAN_VERTICAL, periodic=False, seed=None):
+    mesh = ArrayMesh(side_size, mesh_type, seed, periodic=periodic)
+    items_num = mesh.get_items_number()
+
+    spans = np.zeros(items_num + 1, dtype=bool)
+    largest_cluster_size = np.zeros(items_num + 1, dtype=np.int64)
+    clusters_number = np.zeros(items_num + 1, dtype=np.int64)
+    mean_cluster_size = np.zeros(items_num + 1)
+    susceptibility = np.zeros(items_num + 1)
+    cluster_stats = mesh.get_cluster_stats()
+
+    if mesh_type == Mesh.TYPE_BOND:
+        activate = mesh.activate_next_random_connection
+    else:
+        activate = mesh.activate_next_random_node
+
+    for n in range(items_num + 1):
+        if n > 0:
+            activate()
+        spans[n] = mesh.check_percollation(criterion)
+        largest_cluster_size[n] = mesh.get_largest_cluster_size()
+        clusters_number[n] = mesh.get_clusters_number()
+        mean_cluster_size[n] = cluster_stats.get_mean_cluster_size()
+        susceptibility[n] = cluster_stats.get_susceptibility()
+
+    return {
+        "spans": spans,
+        "largest_cluster_size": largest_cluster_size,
+        "clusters_number": clusters_number,
+        "mean_cluster_size": mean_cluster_size,
+        "susceptibility": susceptibility,
+    }
+
+
+def sweep_replicas(side_size, mesh_type, replicas_num, criterion=Mesh.SPAN_VERTICAL, periodic=False, seed=None):
+    # microcanonical observables averaged over replicas, replicas seeds are drawn from generator seeded with seed
+    rng = np.random.default_rng(seed)
+    acc = None
+    for _ in range(replicas_num):
+        res = sweep(side_size, mesh_type, criterion, periodic, int(rng.integers(2 ** 63)))
+        if acc is None:
+            acc = {name: res[name].astype(np.float64) for name in OBSERVABLES}
+        else:
+            for name in OBSERVABLES:
+                acc[name] += res[name]
+    return {name: values / replicas_num for name, values in acc.items()}
+
+
+def log_binomial_coefficients(items_num):
+    # log C(N, n) for n in [0; N], built as cumulative sum of log((N - n + 1) / n)
+    n = np.arange(1, items_num + 1, dtype=np.float64)
+    return np.concatenate(([0.], np.cumsum(np.log(items_num - n + 1) - np.log(n))))
+
+
+def binomial_weights(items_num, p, log_coeffs=None):
+    assert 0 <= p <= 1, "Probability should be in [0; 1]"
+    weights = np.zeros(items_num + 1)
+    if p == 0:
+        weights[0] = 1
+        return weights
+    if p == 1:
+        weights[-1] = 1
+        return weights
+
+    if log_coeffs is None:
+        log_coeffs = log_binomial_coefficients(items_num)
+    n = np.arange(items_num + 1)
+    weights = np.exp(log_coeffs + n * np.log(p) + (items_num - n) * np.log1p(-p))
+    return weights / weights.sum()
+
+
+def canonical_average(observable, probabilities):
+    # observable - microcanonical values Q_n of shape (N + 1,) (or (R, N + 1) for several replicas)
+    # returns Q(p) for every p of probabilities, shape (len(probabilities),) (or (R, len(probabilities)))
+    observable = np.asarray(observable, dtype=np.float64)
+    items_num = observable.shape[-1] - 1
+    log_coeffs = log_binomial_coefficients(items_num)
+
+    res = np.empty(observable.shape[:-1] + (len(probabilities),))
+    for i, p in enumerate(probabilities):
+        res[..., i] = observable @ binomial_weights(items_num, p, log_coeffs)
+    return res
+
+
+def canonical_curves(microcanonical, probabilities):
+    return {name: canonical_average(values, probabilities) for name, values in microcanonical.items()}
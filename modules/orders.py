@@ -0,0 +1,79 @@
+import numpy as np
+
+# orders with more items than this are generated lazily by default
+LAZY_ORDER_THRESHOLD = 2 ** 26
+LAZY_CHUNK_SIZE = 2 ** 20
+
+FEISTEL_ROUNDS = 4
+
+
+def index_dtype(max_value):
+    # smallest integer type able to hold every node/bond index of the mesh
+    return np.int32 if max_value < np.iinfo(np.int32).max else np.int64
+
+
+def permutation_chunks(items_num, seed=None):
+    # whole activation order as one compact integer array
+    rng = np.random.default_rng(seed)
+    yield rng.permutation(items_num).astype(index_dtype(items_num))
+
+
+def _mix(values, key):
+    # splitmix64 finalizer of (values ^ key), arithmetic is modulo 2^64
+    values = values ^ key
+    values ^= values >> np.uint64(30)
+    values *= np.uint64(0xbf58476d1ce4e5b9)
+    values ^= values >> np.uint64(27)
+    values *= np.uint64(0x94d049bb133111eb)
+    values ^= values >> np.uint64(31)
+    return values
+
+
+def lazy_permutation_chunks(items_num, seed=None, chunk_size=LAZY_CHUNK_SIZE):
+    # Pseudorandom permutation of [0; items_num) produced chunk by chunk without materializing all indices.
+    #
+    # Balanced Feistel network with keyed rounds is a bijection of [0; 4^h) where 4^h >= items_num. Its images of
+    #   0, 1, 2, ... are taken in order and those >= items_num are dropped (domain is at most 4 times larger),
+    #   what leaves a permutation of [0; items_num). Memory is O(chunk_size), setup is O(1).
+    half_bits = max(1, (int(items_num - 1).bit_length() + 1) // 2)
+    half_mask = np.uint64((1 << half_bits) - 1)
+    domain_size = 1 << (2 * half_bits)
+    keys = np.random.default_rng(seed).integers(0, 2 ** 63, size=FEISTEL_ROUNDS, dtype=np.uint64)
+    dtype = index_dtype(items_num)
+
+    with np.errstate(over="ignore"):
+        for start in range(0, domain_size, chunk_size):
+            values = np.arange(start, min(start + chunk_size, domain_size), dtype=np.uint64)
+            left, right = values >> np.uint64(half_bits), values & half_mask
+            for key in keys:
+                left, right = right, left ^ (_mix(right, key) & half_mask)
+            values = (left << np.uint64(half_bits)) | right
+            values = values[values < np.uint64(items_num)]
+            if values.size:
+                yield values.astype(dtype)
+
+
+def is_lazy_order(items_num, lazy=None):
+    # lazy=None - lazy only for orders with more than LAZY_ORDER_THRESHOLD items.
+    #   Lazy and permutation orders of the same seed differ, so results depend on the kind of order too
+    return items_num > LAZY_ORDER_THRESHOLD if lazy is None else bool(lazy)
+
+
+def activation_order_chunks(items_num, seed=None, lazy=None):
+    if is_lazy_order(items_num, lazy):
+        return lazy_permutation_chunks(items_num, seed)
+    return permutation_chunks(items_num, seed)
+
+
+def activation_order(items_num, seed=None, lazy=None, start=0):
+    # generator of items ids (python ints) in activation order, start - number of first items to skip
+    #   (e.g. already activated by resumed mesh), skipped chunks are not converted to python ints
+    to_skip = start
+    for chunk in activation_order_chunks(items_num, seed, lazy):
+        if to_skip >= chunk.size:
+            to_skip -= chunk.size
+            continue
+        chunk, to_skip = chunk[to_skip:], 0
+        # chunk is converted to python ints by parts (permutation order is one chunk of all items)
+        for offset in range(0, chunk.size, LAZY_CHUNK_SIZE):
+            yield from chunk[offset:offset + LAZY_CHUNK_SIZE].tolist()
@@ -0,0 +1,113 @@
+import os
+
+import numpy as np
+from modules.structures import Mesh
+
+# Raster cluster map: every node is one pixel (or block of pixels) colored by root of its cluster.
+#
+# Frame is built with numpy from root ids of all nodes and pushed to Tk as one image (RasterVisualizer) or written
+#   to PNG file without any display (PngFrameWriter), so meshes of thousands of nodes per side can be inspected.
+#   Tk and matplotlib are imported only when they are used.
+
+ABSENT_COLOR = (0, 0, 0)
+SINGLE_NODE_COLOR = (60, 60, 60)
+SPANNING_COLOR = (255, 0, 0)
+
+
+def cluster_map_rgb(mesh, block=1):
+    # (k * block, k * block, 3) uint8 image of mesh clusters (layers of 3-D lattice are stacked vertically)
+    size = mesh.get_size()
+    roots = mesh.get_root_ids()
+    present = mesh.get_present_nodes()
+
+    # pseudorandom muted color of every root (red channel is limited, so spanning cluster stands out)
+    hashed = (roots.astype(np.uint64) * np.uint64(2654435761)) & np.uint64(0xffffff)
+    rgb = np.stack([hashed >> np.uint64(16), hashed >> np.uint64(8), hashed], axis=1) & np.uint64(0xff)
+    rgb = (40 + rgb * 160 // 255).astype(np.uint8)
+    rgb[:, 0] //= 2
+
+    cluster_sizes = np.bincount(roots[present], minlength=roots.size)[roots]
+    rgb[cluster_sizes == 1] = SINGLE_NODE_COLOR
+
+    sentinels = mesh.get_roots_sentinels(roots)
+    spanning = ((sentinels & Mesh.SENTINEL_TOP > 0) & (sentinels & Mesh.SENTINEL_BOTTOM > 0)) | \
+               ((sentinels & Mesh.SENTINEL_LEFT > 0) & (sentinels & Mesh.SENTINEL_RIGHT > 0))
+    rgb[spanning & present] = SPANNING_COLOR
+    rgb[~present] = ABSENT_COLOR
+
+    image = rgb.reshape(-1, size, 3)
+    if block > 1:
+        image = image.repeat(block, axis=0).repeat(block, axis=1)
+    return image
+
+
+def to_ppm(image):
+    height, width, _ = image.shape
+    return "P6 {} {} 255 ".format(width, height).encode() + image.tobytes()
+
+
+def save_png(mesh, path, block=1):
+    from matplotlib import image as mpl_image
+    mpl_image.imsave(path, cluster_map_rgb(mesh, block))
+
+
+class RasterVisualizer:
+    WIN_SIZE = (500, 500)
+    MAX_FPS = 25
+
+    # Tk window showing cluster map of mesh of any size, one image per frame.
+    # Same draw_mesh API as visualizer.Visualizer, frames are rate limited the same way
+
+    def __init__(self, block=None, max_fps=MAX_FPS):
+        from tkinter import Tk, Canvas
+
+        assert max_fps > 0, "Frame rate should be > 0"
+        self._block = block
+        self._max_fps = max_fps
+        self._last_frame_time = None
+        self._image = None
+        self._image_item = None
+
+        self._root = Tk()
+        self._canvas = Canvas(self._root, width=self.WIN_SIZE[0], height=self.WIN_SIZE[1], bg="black")
+        self._canvas.pack()
+
+    def draw_mesh(self, mesh, force=False):
+        from tkinter import PhotoImage, NW
+        from time import time
+
+        now = time()
+        if not force and self._last_frame_time is not None and now - self._last_frame_time < 1 / self._max_fps:
+            return
+        self._last_frame_time = now
+
+        block = self._block or max(1, min(self.WIN_SIZE) // mesh.get_size())
+        image = cluster_map_rgb(mesh, block)
+        # new image is created before old one is dropped, so canvas never shows empty frame
+        self._image = PhotoImage(width=image.shape[1], height=image.shape[0], data=to_ppm(image), format="PPM")
+        if self._image_item is None:
+            self._canvas.configure(width=image.shape[1], height=image.shape[0])
+            self._image_item = self._canvas.create_image(0, 0, image=self._image, anchor=NW)
+        else:
+            self._canvas.itemconfigure(self._image_item, image=self._image)
+        self._root.update()
+
+
+class PngFrameWriter:
+    # headless frames recorder: writes cluster map to directory/frame_XXXXXX.png every `every` draw_mesh calls
+
+    def __init__(self, directory, every=1, block=1):
+        assert every > 0, "Frames period should be > 0"
+        os.makedirs(directory, exist_ok=True)
+        self._directory = directory
+        self._every = every
+        self._block = block
+        self._calls = 0
+        self._frames = 0
+
+    def draw_mesh(self, mesh, force=False):
+        self._calls += 1
+        if not force and (self._calls - 1) % self._every:
+            return
+        save_png(mesh, os.path.join(self._directory, "frame_{:06d}.png".format(self._frames)), self._block)
+        self._frames += 1
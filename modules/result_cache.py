@@ -0,0 +1,148 @@
+import ast
+import functools
+import hashlib
+import inspect
+import json
+import os
+import tempfile
+
+# modules whose code determines experiment results, any change of them or of modules they import (transitively)
+#   gives new engine version
+ENGINE_MODULES = ("structures", "array_mesh", "invasion", "orders", "lattices", "cluster_stats",
+                  "kernels")
+# default size limit of cache directory
+CACHE_MAX_BYTES = 64 * 2 ** 20
+
+
+def _imported_modules(source):
+    # names of modules of this package imported by source code
+    names = []
+    for node in ast.walk(ast.parse(source)):
+        if isinstance(node, ast.ImportFrom) and node.module == "modules":
+            names += [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.module is not None and node.module.startswith("modules."):
+            names.append(node.module[len("modules."):])
+        elif isinstance(node, ast.Import):
+            names += [alias.name[len("modules."):] for alias in node.names if alias.name.startswith("modules.")]
+    return names
+
+
+def engine_modules():
+    # sorted names of ENGINE_MODULES and all modules of this package they import
+    modules_dir = os.path.dirname(os.path.abspath(__file__))
+    names, stack = set(), list(ENGINE_MODULES)
+    while stack:
+        name = stack.pop()
+        if name in names:
+            continue
+        names.add(name)
+        with open(os.path.join(modules_dir, name + ".py")) as f:
+            stack += _imported_modules(f.read())
+    return sorted(names)
+
+
+@functools.lru_cache(maxsize=None)
+def engine_version(*functions):
+    # hash of source code of engine_modules() and given functions (e.g. main.conduct_experiment)
+    digest = hashlib.sha256()
+    modules_dir = os.path.dirname(os.path.abspath(__file__))
+    for name in engine_modules():
+        with open(os.path.join(modules_dir, name + ".py"), "rb") as f:
+            digest.update(f.read())
+    for function in functions:
+        digest.update(inspect.getsource(function).encode())
+    return digest.hexdigest()[:16]
+
+
+class ResultCache:
+    # Persistent content-addressed cache of experiments results.
+    #
+    # Key is hash of experiment parameters (size, type, engine, criterion, boundary, lattice, seed) and engine version,
+    #   so the same experiment run by any sweep, batch or worker is taken from cache, and entries made by older
+    #   simulation code are never hit (they are evicted in time). Every entry is a small JSON file
+    #   <dir>/<key[:2]>/<key>.json, its modification time is the last access time. When total size exceeds max_bytes,
+    #   least recently used entries are removed down to 3/4 of the limit.
+    #
+    # Several processes may share the directory: entries are written atomically and every process evicts by its own
+    #   estimate of total size (directory is scanned on the first write of the process)
+
+    def __init__(self, directory, version, max_bytes=CACHE_MAX_BYTES):
+        assert max_bytes > 0, "Cache size limit should be > 0"
+        self._directory = directory
+        self._version = version
+        self._max_bytes = max_bytes
+        self._total_bytes = None
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, **params):
+        data = json.dumps({"params": params, "version": self._version}, sort_keys=True)
+        return hashlib.sha256(data.encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self._directory, key[:2], key + ".json")
+
+    def get(self, key):
+        # cached value or None
+        path = self._path(key)
+        try:
+            with open(path) as f:
+                value = json.load(f)
+            os.utime(path)
+        except (FileNotFoundError, ValueError):
+            return None
+        return value
+
+    def put(self, key, value):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = json.dumps(value)
+        # unique temporary file: processes sharing the directory may write the same key at once
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            f.write(data)
+        # overwritten entry doesn't add its size again
+        try:
+            old_size = os.path.getsize(path)
+        except FileNotFoundError:
+            old_size = 0
+        os.replace(tmp_path, path)
+
+        if self._total_bytes is None:
+            self._total_bytes = sum(size for _, size, _ in self._entries())
+        else:
+            self._total_bytes += len(data) - old_size
+        if self._total_bytes > self._max_bytes:
+            self._evict()
+
+    def _entries(self):
+        # (path, size, last access time) of all entries
+        for shard in os.listdir(self._directory):
+            shard_dir = os.path.join(self._directory, shard)
+            if not os.path.isdir(shard_dir):
+                continue
+            for name in os.listdir(shard_dir):
+                if not name.endswith(".json"):
+                    continue
+                path = os.path.join(shard_dir, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield path, stat.st_size, stat.st_mtime
+
+    def _evict(self):
+        entries = sorted(self._entries(), key=lambda entry: entry[2])
+        total = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if total <= self._max_bytes * 3 // 4:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                # removed by other process
+                pass
+            total -= size
+        self._total_bytes = total
+
+    def get_total_bytes(self):
+        return sum(size for _, size, _ in self._entries())
@@ -0,0 +1,72 @@
+import os
+from itertools import islice
+
+import numpy as np
+
+
+class ResultsStore:
+    # Append-only on-disk store of experiments results (CSV file with header).
+    #
+    # Every finished experiment is appended (and flushed) as soon as it arrives, so interrupted sweep loses at most
+    #   the experiments which were running. Experiment is identified by (size, type, replica) key. Records are read back
+    #   in chunks of rows, so averages can be computed over stores of any size and over several sessions.
+
+    FIELDS = ("size", "type", "replica", "seed", "threshold", "runtime")
+
+    def __init__(self, path):
+        self._path = path
+
+        dir_name = os.path.dirname(path)
+        if dir_name:
+            os.makedirs(dir_name, exist_ok=True)
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            with open(path, "w") as f:
+                f.write(",".join(self.FIELDS) + "\n")
+        else:
+            self._drop_partial_record()
+
+    def _drop_partial_record(self):
+        # last record may be cut if previous session crashed while writing it
+        with open(self._path, "rb+") as f:
+            content_end = f.seek(0, os.SEEK_END)
+            f.seek(max(content_end - 4096, 0))
+            tail = f.read()
+            if tail.endswith(b"\n"):
+                return
+            f.truncate(content_end - (len(tail) - tail.rfind(b"\n") - 1))
+
+    def get_path(self):
+        return self._path
+
+    def append(self, record: dict):
+        line = ",".join(repr(record[field]) if isinstance(record[field], float) else str(record[field])
+                        for field in self.FIELDS)
+        with open(self._path, "a") as f:
+            f.write(line + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def iter_chunks(self, chunk_rows=100000):
+        # yields dicts {field: numpy array} with at most chunk_rows records each
+        with open(self._path) as f:
+            next(f)  # header
+            while True:
+                lines = [line for line in islice(f, chunk_rows) if line.endswith("\n")]
+                if not lines:
+                    return
+                data = np.loadtxt(lines, delimiter=",", ndmin=2, dtype=np.float64)
+                yield {field: data[:, i] for i, field in enumerate(self.FIELDS)}
+
+    def averages(self, field="threshold"):
+        # {(type, size): mean of field over all stored replicas}
+        sums, counts = {}, {}
+        for chunk in self.iter_chunks():
+            cells, inverse = np.unique(np.stack([chunk["type"], chunk["size"]], axis=1).astype(np.int64),
+                                       axis=0, return_inverse=True)
+            inverse = inverse.ravel()
+            chunk_sums = np.bincount(inverse, weights=chunk[field])
+            chunk_counts = np.bincount(inverse)
+            for cell, cell_sum, cell_count in zip(map(tuple, cells.tolist()), chunk_sums, chunk_counts):
+                sums[cell] = sums.get(cell, 0.) + cell_sum
+                counts[cell] = counts.get(cell, 0) + int(cell_count)
+        return {cell: float(sums[cell] / counts[cell]) for cell in sums}
@@ -0,0 +1,134 @@
+import math
+import time
+
+import numpy as np
+
+
+def task_seed(master_seed, size, type, replica):
+    # independent stream of every experiment spawned from one master seed. It depends only on experiment key,
+    #   so any experiment of a sweep is reproduced regardless of processes number and tasks order
+    state = np.random.SeedSequence(master_seed, spawn_key=(size, type, replica)).generate_state(1)
+    return int(state[0])
+
+
+def estimate_runtime(size, type):
+    # rough cost model for cells without statistics: work grows as number of items (~size^2) times root search cost
+    return size ** 2 * math.log2(size + 1) * (2 if type == 1 else 1)
+
+
+class CellStats:
+    # running statistics of thresholds of one (size, type) cell (Welford's algorithm)
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.
+        self._m2 = 0.
+        self.runtime = 0.
+        self.pending = 0
+        self.next_replica = 0
+
+    def add(self, threshold, runtime):
+        self.count += 1
+        delta = threshold - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (threshold - self.mean)
+        self.runtime += runtime
+
+    def variance(self):
+        return self._m2 / (self.count - 1) if self.count > 1 else math.inf
+
+    def standard_error(self):
+        return math.sqrt(self.variance() / self.count) if self.count > 1 else math.inf
+
+    def mean_runtime(self):
+        return self.runtime / self.count if self.count else 0.
+
+
+class AdaptiveScheduler:
+    # Decides which (size, type) cell gets the next experiments.
+    #
+    # Cell is finished when standard error of its mean threshold is below tolerance (in activated items).
+    #   Every cell gets at least min_replicas experiments first, after that new experiment goes to the cell where it
+    #   reduces squared standard error of the mean (i.e. contribution of the cell to uncertainty of the fit)
+    #   most per CPU-second: s^2 / (n * (n + 1)) / mean_runtime. Experiments in flight are counted as done, so parallel
+    #   workers are spread over cells, and cell whose standard error with experiments in flight (s / sqrt(n)) is already
+    #   below tolerance gets no more of them until its results change the estimate. No new experiments are given
+    #   after time budget (seconds) is over.
+    #
+    # Tasks are given in chunks of experiments of one cell with total runtime about chunk_runtime seconds, so cheap
+    #   experiments don't pay for inter-process communication one by one, while expensive ones go alone. Cells without
+    #   statistics are started from the most expensive ones, so they don't become stragglers at the end of the sweep.
+
+    def __init__(self, cells, tolerance, time_budget=None, min_replicas=2, master_seed=None, chunk_runtime=0.5):
+        assert tolerance > 0, "Tolerance should be > 0"
+        assert min_replicas >= 2, "At least 2 replicas are needed to estimate standard error"
+        self._cells = {cell: CellStats() for cell in cells}
+        self._tolerance = tolerance
+        self._min_replicas = min_replicas
+        self._deadline = None if time_budget is None else time.time() + time_budget
+        self._master_seed = master_seed
+        self._chunk_runtime = chunk_runtime
+
+    def get_cell_stats(self, cell):
+        return self._cells[cell]
+
+    def add_result(self, size, type, replica, threshold, runtime, pending=True):
+        # pending=False for results not given by this scheduler (e.g. loaded from results store)
+        cell = self._cells.get((size, type))
+        if cell is None:
+            return
+        if pending:
+            cell.pending -= 1
+        cell.next_replica = max(cell.next_replica, replica + 1)
+        cell.add(threshold, runtime)
+
+    def _is_cell_done(self, cell):
+        return cell.count >= self._min_replicas and cell.standard_error() < self._tolerance
+
+    def _is_cell_planned(self, cell):
+        # cell is done when its experiments in flight finish, if variance estimate holds
+        n = cell.count + cell.pending
+        return cell.count >= self._min_replicas and cell.variance() / n < self._tolerance ** 2
+
+    def _priority(self, key, cell):
+        n = cell.count + cell.pending
+        if n < self._min_replicas:
+            # cells without enough statistics go first, the least started and the most expensive ones first
+            return math.inf, -n, estimate_runtime(*key)
+        sem2_reduction = cell.variance() / (n * (n + 1))
+        return sem2_reduction / max(cell.mean_runtime(), 1e-6), 0, 0
+
+    def _chunk_size(self, cell):
+        n = cell.count + cell.pending
+        if n < self._min_replicas:
+            return self._min_replicas - n
+        chunk_size = int(self._chunk_runtime / max(cell.mean_runtime(), 1e-6))
+        # not more than half of already planned experiments and than the estimate of missing ones,
+        #   so tolerance is not overshot much
+        missing = math.ceil(cell.variance() / self._tolerance ** 2) - n
+        return max(1, min(chunk_size, n // 2, missing))
+
+    def is_time_over(self):
+        return self._deadline is not None and time.time() > self._deadline
+
+    def is_finished(self):
+        return self.is_time_over() or all(self._is_cell_done(cell) for cell in self._cells.values())
+
+    def next_tasks(self):
+        # list of (size, type, replica, seed) of next experiments or None if nothing should be run now
+        if self.is_time_over():
+            return None
+        candidates = [(key, cell) for key, cell in self._cells.items()
+                      if not self._is_cell_done(cell) and not self._is_cell_planned(cell)]
+        # cell waiting for first results of its pending experiments has no statistics to decide on
+        candidates = [(key, cell) for key, cell in candidates
+                      if cell.count >= self._min_replicas or cell.count + cell.pending < self._min_replicas]
+        if not candidates:
+            return None
+
+        (size, type), cell = max(candidates, key=lambda item: self._priority(*item))
+        chunk_size = self._chunk_size(cell)
+        replicas = range(cell.next_replica, cell.next_replica + chunk_size)
+        cell.pending += chunk_size
+        cell.next_replica += chunk_size
+        return [(size, type, replica, task_seed(self._master_seed, size, type, replica)) for replica in replicas]
@@ -1,6 +1,8 @@
-import random
-import itertools
+import numpy as np
 from modules.utils import flatten
+from modules.orders import activation_order
+from modules.cluster_stats import ClusterStats
+from modules.lattices import SENTINEL_TOP, SENTINEL_BOTTOM, SENTINEL_LEFT, SENTINEL_RIGHT, square
 
 # SEED = 5
 SEED = None
@@ -16,6 +18,11 @@ class TreeNode:
 
     _active = False
 
+    # bit mask of mesh sides (Mesh.SENTINEL_*) the cluster is connected to, relevant only in root node
+    _sentinels = 0
+    # number of nodes in the cluster, relevant only in root node
+    _cluster_size = 1
+
     def __init__(self, id: int, parent=None, children=None):
         if parent is not None:
             assert isinstance(parent, TreeNode)
@@ -47,6 +54,8 @@ class TreeNode:
 
         # paths compression (all nodes in child graph should have this node as direct parent)
         target_graph_nodes = self._get_graph_nodes(starting_node)
+        get_root(self)._sentinels |= get_root(starting_node)._sentinels
+        get_root(self)._cluster_size += get_root(starting_node)._cluster_size
 
         for child in target_graph_nodes:
             self._children.append(child)
@@ -63,6 +72,8 @@ class TreeNode:
             return {"clusters_merged": False}
 
         self._children.append(child)
+        self._sentinels |= child._sentinels
+        self._cluster_size += child._cluster_size
         child._set_parent(self)
         child._cluster_label = None
 
@@ -97,7 +108,10 @@ class TreeNode:
         if self.is_root():
             return self._cluster_label
         else:
-            get_root(self).get_cluster_label()
+            return get_root(self).get_cluster_label()
+
+    def get_cluster_size(self):
+        return get_root(self)._cluster_size
 
     def get_dist_to_root(self):
         return self._dist_to_root
@@ -105,8 +119,12 @@ class TreeNode:
 class Mesh:
     _size = None
     _nodes = None
+    _lattice = None
     _bonds = None
     _clusters_number = None
+    _activated_items_number = 0
+    # cluster_stats.ClusterStats of present clusters
+    _cluster_stats = None
 
     HORIZONTAL = True
     VERTICAL = False
@@ -114,6 +132,25 @@ class Mesh:
     NODES_NUM_LIMIT = 100
     TYPE_BOND = 1
     TYPE_NODE = 0
+    # invasion percollation models (invasion.InvasionMesh): site and bond invasion
+    TYPE_INVASION_NODE = 2
+    TYPE_INVASION_BOND = 3
+
+    # percollation criteria for check_percollation
+    SPAN_VERTICAL = 0  # up-to-down
+    SPAN_HORIZONTAL = 1  # left-to-right
+    SPAN_EITHER = 2
+    SPAN_BOTH = 3
+
+    # Virtual sentinel clusters (one per mesh side). Node on a side joins the side's sentinel when it is activated
+    #   (in bond model - when mesh is created). Instead of real sentinel nodes in the forest (they would glue
+    #   together unrelated clusters touching the same side and break clusters counting) every root keeps bit mask
+    #   of sentinels its cluster is joined to, masks are OR-ed on merge. So spanning is detected at merge time
+    #   and check_percollation is O(1) for every criterion
+    SENTINEL_TOP = SENTINEL_TOP
+    SENTINEL_BOTTOM = SENTINEL_BOTTOM
+    SENTINEL_LEFT = SENTINEL_LEFT
+    SENTINEL_RIGHT = SENTINEL_RIGHT
 
     # one builds activation sequence of bonds - order in which they will be activated later
     _random_items_gen = None
@@ -142,33 +179,46 @@ class Mesh:
     #   ]
     # where Ni is an instance of class TreeNode
     #
-    # Connections (bonds) are stored in form of tuples in 2-D array (self._bonds) as follows:
-    #   [
-    #       [(C0a, C0b), (C1a, C1b), .., (C[k-2]a, C[k-2]b), (None, C[k-1])],
-    #       ...,
-    #       [(None, C[k*(k-1)+1]b), (None, C[k*(k-1)+2]b), ..., (None, C[k^2-1]b), (None, None) ]
-    #   ]
-    # where Ci is a boolean value which indicates if connection is activated, or not. None means that there is no such connection
+    # Only existing connections (bonds) are stored, in boolean array of 2*k*(k-1) elements (True - activated):
+    #   [C0a, C1a, .., C[k-2]a, Cka, .., C[k^2-2]a, C0b, C1b, .., C[k*(k-1)-1]b]
+    #   i.e. all "a" bonds row by row, then "b" bonds (bond k*(k-1) + i connects nodes i and i + k),
+    #   same as in ArrayMesh
+    #
+    # Geometry comes from lattices.Lattice tables (square lattice by default). Other lattices (triangular, honeycomb,
+    #   square with next nearest neighbours, simple cubic) use the same code, nodes are then stored in
+    #   nodes_num / k rows of k nodes and bond ids are rows of lattice bond_nodes table
 
-    def __init__(self, side_size: int, type: int):
+    def __init__(self, side_size: int, type: int, seed=None, stats=None, lattice=None):
         assert type == self.TYPE_BOND or type == self.TYPE_NODE, "Unacceptable mesh type"
         assert 0 < side_size <= self.NODES_NUM_LIMIT, "Unacceptable mesh side size"
         self._type = type
+        # seed of activation sequence, module SEED is used if not set
+        self._seed = SEED if seed is None else seed
+        # instrumentation.Counters of hot paths or None (disabled)
+        self._stats = stats
 
         self._size = side_size
+        # lattices.Lattice of geometry
+        self._lattice = square(side_size) if lattice is None else lattice
+        assert self._lattice.side_size == side_size, "Lattice of other side size"
 
+        rows_num = self._lattice.nodes_num // self._size
         self._nodes = [
-            [TreeNode(k * self._size + i) for i in range(self._size)] for k in range(self._size)]
-        self._clusters_number = self._size ** 2
+            [TreeNode(k * self._size + i) for i in range(self._size)] for k in range(rows_num)]
+        # in node model clusters appear with activated nodes
+        self._clusters_number = self._lattice.nodes_num if type == self.TYPE_BOND else 0
+        self._cluster_stats = ClusterStats({1: self._lattice.nodes_num} if type == self.TYPE_BOND else None)
+        self._activated_items_number = 0
+        self._spans_vertically = False
+        self._spans_horizontally = False
 
         if type == self.TYPE_BOND:
-            # creating connections(bonds) matrix
-            self._bonds = [[(False, False) for _ in range(self._size - 1)] for _ in
-                           range(self._size - 1)]  # one needs to process last row and last column in unique way
-            for bond_row in self._bonds:
-                bond_row.extend([(None, False)])  # adding last column
-            self._bonds.append([(False, None)] * self._size),
-            self._bonds[-1][-1] = (None, None)  # fixing last element
+            # in bond model all nodes are present from the beginning, so they join sentinels right away
+            for node in flatten(self._nodes):
+                node._sentinels = self._node_sentinels(node.get_id())
+                self._update_spanning(node._sentinels)
+
+            self._bonds = np.zeros(self._lattice.bonds_num, dtype=bool)
 
             # creating geneator
             self._random_items_gen = self._random_bonds_generator()
@@ -176,112 +226,53 @@ class Mesh:
             self._random_items_gen = self._random_nodes_generator()
 
     def _random_bonds_generator(self):
-        # creating bonds activation sequence (tuples of (node_id, is_bond_horizontal)).
-        #   If node is not horizontal, then it is vertical
-        all_bonds = itertools.chain(
-            zip(range(self._size ** 2), itertools.repeat(True, self._size ** 2)),
-            zip(range(self._size ** 2), itertools.repeat(False, self._size ** 2))
-        )
-        # shuffling data
-        all_bonds = list(all_bonds)
-        if SEED:
-            random.seed(SEED)
-        random.shuffle(all_bonds)
-        for bond in all_bonds:
-            yield bond
+        # creating bonds activation sequence (bond ids) of existing bonds only
+        yield from activation_order(self._lattice.bonds_num, self._seed)
 
     def _random_nodes_generator(self):
-        all_nodes = [node.get_id() for node in flatten(self._nodes)]
-        if SEED:
-            random.seed(SEED)
-        random.shuffle(all_nodes)
-        for node in all_nodes:
-            yield node
+        yield from activation_order(self._lattice.nodes_num, self._seed)
 
     def _is_node_id_ok(self, node_id):
-        return 0 <= node_id < self._size ** 2
+        return 0 <= node_id < self._lattice.nodes_num
 
-    def _is_bond_exists(self, node_id, direction: bool):
-        assert self._is_node_id_ok(node_id), "Wrong node id"
+    def _node_sentinels(self, node_id):
+        return int(self._lattice.node_sentinels[node_id])
 
-        ind = self._node_id_to_indices(node_id)
-        bond_tuple = self._bonds[ind[0]][ind[1]]
-        if direction == self.HORIZONTAL:
-            return bond_tuple[0] is not None
-        else:
-            return bond_tuple[1] is not None
+    def _update_spanning(self, sentinels):
+        if sentinels & self.SENTINEL_TOP and sentinels & self.SENTINEL_BOTTOM:
+            self._spans_vertically = True
+        if sentinels & self.SENTINEL_LEFT and sentinels & self.SENTINEL_RIGHT:
+            self._spans_horizontally = True
 
     def _node_id_to_indices(self, node_id):
         col_ind = node_id // self._size
         row_ind = node_id % self._size
         return col_ind, row_ind
 
-    def _indices_to_node_id(self, inds):
-        col_ind, row_ind = inds
-        return col_ind * self._size + row_ind
-
     def _get_adjacent_node_ids(self, node_id):
-        inds = self._node_id_to_indices(node_id)
-        displacements = [(i, k) for i, k in [(-1, 0), (1, 0), (0, 1), (0, -1)]]
-
-        # get all indices of adjacent nodes
-        tgt_indices = [(inds[0] - i, inds[1] - k) for i, k in displacements]
-        # filter nodes not in bounds
-        filtered_inds = [ind for ind in tgt_indices if 0 <= ind[0] < self._size and 0 <= ind[1] < self._size]
-
-        return [self._indices_to_node_id(ind) for ind in filtered_inds]
-
-    def _node_id_from_direction(self, start_node_id, direction: bool):
-        assert self._is_node_id_ok(start_node_id), "Wrong node id"
+        return self._lattice.get_neighbours(node_id)
 
-        if self._is_bond_exists(start_node_id, direction):
-            if direction == self.HORIZONTAL:
-                return start_node_id + 1
-            elif direction == self.VERTICAL:
-                return start_node_id + self._size
-        else:
-            raise ValueError("Wrong direction requested")
-
-    def _are_nodes_adjacent(self, node1_id: int, node2_id: int):
-        ids_displ = abs(node1_id - node2_id)
-        return ids_displ == 1 or ids_displ == self._size
-
-    def _activate_bond(self, node_id, direction: bool):
+    def _activate_bond(self, bond_id):
         res = {"bond_not_exists": None,
                "bond_already_activated": None,
                "clusters_merged": None}
 
-        assert self._is_node_id_ok(node_id), "Wrong node id"
-        if not self._is_bond_exists(node_id, direction):
-            res["bond_not_exists"] = True
+        if self._bonds[bond_id]:
+            res["bond_already_activated"] = True
+            if self._stats is not None:
+                self._stats.add("wasted_activations")
             return res
+        self._bonds[bond_id] = True
+        self._activated_items_number += 1
 
-        inds = self._node_id_to_indices(node_id)
-        tgt_tuple = self._bonds[inds[0]][inds[1]]
-        if direction == self.HORIZONTAL:
-            if tgt_tuple[0]:
-                res["bond_already_activated"] = True
-                return res
-            else:
-                new_tgt_tuple_val = (True, tgt_tuple[1])
-        elif direction == self.VERTICAL:
-            if tgt_tuple[1]:
-                res["bond_already_activated"] = True
-                return res
-            else:
-                new_tgt_tuple_val = (tgt_tuple[0], True)
-        else:
-            raise ValueError("Incorrect argument passed: is_horizontal = {}".format(direction))
-
-        self._bonds[inds[0]][inds[1]] = new_tgt_tuple_val
-
-        combine_res = self._combine_clusters([node_id,
-                                              self._node_id_from_direction(node_id, direction)])
+        node1_id, node2_id = self._lattice.bond_nodes[bond_id].tolist()
+        combine_res = self._combine_clusters([node1_id, node2_id])
         res["clusters_merged"] = combine_res["clusters_merged"]
         return res
 
     @staticmethod
     def _compress_path(node: TreeNode):
+        # returns (parent links followed to the root before compression, nodes re-linked to the root)
         nodes_travelled = []
 
         cur_node = node
@@ -294,21 +285,35 @@ class Mesh:
 
             cur_node = cur_node.get_parent()
 
+        relinked = 0
         for node in nodes_travelled:
+            relinked += node._parent is not root_node
             node._parent = root_node
+        return len(nodes_travelled), relinked
 
     def _combine_clusters(self, node_ids_list):
         nodes = [self.get_node(node_id) for node_id in node_ids_list]
         merged_clusters = 0
 
+        # root search is done by path compression, so path length is counted before it (like in ArrayMesh)
         for node in nodes:
-            Mesh._compress_path(node)
+            path_length, relinked = Mesh._compress_path(node)
+            if self._stats is not None:
+                self._stats.add("find_calls")
+                self._stats.add("find_path_length", path_length)
+                self._stats.add("compressions", relinked)
 
         nodes_roots = [get_root(node) for node in nodes]
         root_0 = nodes_roots[0]
         for root in nodes_roots[1:]:
+            sizes = root_0._cluster_size, root._cluster_size
             if root_0.add_child(root)["clusters_merged"]:
                 merged_clusters += 1
+                self._reduce_clusters_num()
+                self._cluster_stats.merge(*sizes)
+        self._update_spanning(root_0._sentinels)
+        if self._stats is not None:
+            self._stats.add("unions", merged_clusters)
 
         return {"clusters_merged": merged_clusters}
 
@@ -322,21 +327,23 @@ class Mesh:
         return self._nodes
 
     def all_bonds(self):
+        # boolean array of activation state of all bonds (in bond ids order), None in node model
         return self._bonds
 
+    def get_lattice(self):
+        return self._lattice
+
     def activate_next_random_connection(self):
         try:
             next_connection = next(self._random_items_gen)
         except StopIteration:
             return None
 
-        res = self._activate_bond(next_connection[0], next_connection[1])
+        res = self._activate_bond(next_connection)
 
         res["next_connection"] = next_connection
-        if res["clusters_merged"]:
-            self._reduce_clusters_num()
-            if self._clusters_number == 1:
-                res["one_cluster_left"] = True
+        if res["clusters_merged"] and self._clusters_number == 1:
+            res["one_cluster_left"] = True
 
         return res
 
@@ -347,6 +354,10 @@ class Mesh:
             return None
         next_node = self.get_node(next_node_id)
         next_node.activate()
+        self._activated_items_number += 1
+        self._clusters_number += 1
+        self._cluster_stats.add(1)
+        next_node._sentinels = self._node_sentinels(next_node_id)
         adjacent_active_nodes_ids = [_id for _id in self._get_adjacent_node_ids(next_node.get_id()) if
                                      self.get_node(_id).is_activated()]
         self._combine_clusters([next_node_id] + adjacent_active_nodes_ids)
@@ -354,33 +365,75 @@ class Mesh:
     def get_size(self):
         return self._size
 
+    def get_nodes_number(self):
+        return self._lattice.nodes_num
+
+    def get_clusters_number(self):
+        return self._clusters_number
+
+    def get_largest_cluster_size(self):
+        return self._cluster_stats.get_largest_cluster_size()
+
+    def get_cluster_stats(self):
+        # cluster_stats.ClusterStats kept up to date by the mesh (histogram n_s, mean size, susceptibility, ..)
+        return self._cluster_stats
+
+    def get_root_ids(self):
+        # root id of every node (array of k^2)
+        return np.array([get_root(node).get_id() for node in flatten(self._nodes)])
+
+    def get_present_nodes(self):
+        # nodes which belong to clusters: all in bond model, activated ones in node model
+        if self._type == self.TYPE_BOND:
+            return np.ones(self._lattice.nodes_num, dtype=bool)
+        return np.array([node.is_activated() for node in flatten(self._nodes)])
+
+    def get_roots_sentinels(self, root_ids):
+        # sentinels (SENTINEL_* mask) of clusters with given roots
+        return np.array([self.get_node(root_id)._sentinels for root_id in np.asarray(root_ids).tolist()],
+                        dtype=np.uint8)
+
     def _reduce_clusters_num(self):
         self._clusters_number -= 1
 
-    def check_percollation(self):
-        # checking up-to-down-percollation
-        upper_nodes_ids = range(self._size)
-        max_n = self._size ** 2
-        lower_nodes_ids = range(max_n - self._size, max_n)
-        for u in upper_nodes_ids:
-            for l in lower_nodes_ids:
-                u_n, l_n = self.get_node(u), self.get_node(l)
-                u_n_par, l_n_par = get_root(u_n), get_root(l_n)
-                if u_n_par.get_id() == l_n_par.get_id():
-                    return True
-        return False
+    def check_percollation(self, criterion=SPAN_VERTICAL):
+        if self._stats is not None:
+            self._stats.add("spanning_checks")
+        return spanning_by_criterion(self._spans_vertically, self._spans_horizontally, criterion)
 
     def calculate_percollation(self):
-        if self._type == self.TYPE_BOND:
-            acc = 0
-            for bond in flatten(self._bonds):
-                acc += bond[0] if bond[0] is not None else 0
-                acc += bond[1] if bond[1] is not None else 0
-            return acc
-        if self._type == self.TYPE_NODE:
-            return sum([node.is_activated() for node in flatten(self._nodes)])
-
-def get_root(node: TreeNode, iters_limit=Mesh.NODES_NUM_LIMIT ** 2):
+        # number of activated items (nodes or bonds)
+        return self._activated_items_number
+
+def boundary_sentinels(node_id, side_size):
+    # sentinels of all mesh sides the node lies on
+    row_ind, col_ind = divmod(node_id, side_size)
+    sentinels = 0
+    if row_ind == 0:
+        sentinels |= Mesh.SENTINEL_TOP
+    if row_ind == side_size - 1:
+        sentinels |= Mesh.SENTINEL_BOTTOM
+    if col_ind == 0:
+        sentinels |= Mesh.SENTINEL_LEFT
+    if col_ind == side_size - 1:
+        sentinels |= Mesh.SENTINEL_RIGHT
+    return sentinels
+
+
+def spanning_by_criterion(spans_vertically, spans_horizontally, criterion):
+    if criterion == Mesh.SPAN_VERTICAL:
+        return spans_vertically
+    if criterion == Mesh.SPAN_HORIZONTAL:
+        return spans_horizontally
+    # bitwise operators, so flags may also be numpy arrays (one flag per replica)
+    if criterion == Mesh.SPAN_EITHER:
+        return spans_vertically | spans_horizontally
+    if criterion == Mesh.SPAN_BOTH:
+        return spans_vertically & spans_horizontally
+    raise ValueError("Unknown percollation criterion: {}".format(criterion))
+
+
+def get_root(node: TreeNode, iters_limit=Mesh.NODES_NUM_LIMIT ** 2, stats=None):
     assert isinstance(node, TreeNode)
 
     root_search_iterations = 0
@@ -394,6 +447,9 @@ def get_root(node: TreeNode, iters_limit=Mesh.NODES_NUM_LIMIT ** 2):
         root_search_iterations += 1
         if root_search_iterations > iters_limit:
             raise RuntimeError("Tree loop detected (more {} iterations done)".format(iters_limit))
+    if stats is not None:
+        stats.add("find_calls")
+        stats.add("find_path_length", root_search_iterations - 1)
     return _cur_node
 
     # if __name__ == '__main__':
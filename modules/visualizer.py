@@ -1,6 +1,9 @@
 from tkinter import Tk, Canvas, LAST as TK_LAST, FIRST as TK_FIRST
 from math import cos, sin, atan, pi
 from collections import namedtuple
+from time import time
+
+import numpy as np
 
 from modules.structures import Mesh, TreeNode
 from modules.utils import flatten
@@ -11,14 +14,26 @@ class Visualizer:
     MIN_CONN_LEN = 20
 
     WIN_SIZE = (500, 500)
+    MAX_FPS = 25
+
+    CONNECTION_COLORS = {
+        True: "green",
+        False: "white"
+    }
+
+    # canvas items handles, created on the first draw
+    _node_items = None
 
     TYPE_BOND = 1
     TYPE_NODE = 0
 
-    def __init__(self, _type):
+    def __init__(self, _type, max_fps=MAX_FPS):
         assert _type == Visualizer.TYPE_BOND or _type == Visualizer.TYPE_NODE, "Wrong Visualizer type"
+        assert max_fps > 0, "Frame rate should be > 0"
 
         self._type = _type
+        self._max_fps = max_fps
+        self._last_frame_time = None
         # super().__init__()
         self._root = Tk()
 
@@ -89,64 +104,85 @@ class Visualizer:
 
         return side_size, nodes_anchors
 
-    def _draw_nodes(self, nodes: list, cell_size, anchors, add_ids=False):
-        # for node_row in nodes:
-        #     for node in node_row:
-        #         assert type(node) == TreeNode, "Wrong node type: {}".format(type(node))
-
+    def _create_items(self, nodes: list, bonds, add_ids):
+        # creating canvas items of all nodes, bonds, labels and parent arrows once, later they are only updated
+        cell_size, anchors = self._get_anchors(len(nodes[0]), len(nodes))
         circle_radius = self._get_circle_radius(cell_size)
+        connection_len = cell_size - circle_radius * 2
 
+        self._cell_size, self._anchors = cell_size, anchors
+        self._node_items, self._label_items, self._arrow_items, self._bond_items = [], [], [], []
         for anchor, node in zip(anchors, flatten(nodes)):
-            center_x = anchor[0]
-            center_y = anchor[1]
-            self._canvas.create_oval(
+            center_x, center_y = anchor
+            self._node_items.append(self._canvas.create_oval(
                 center_x - circle_radius, center_y - circle_radius,
                 center_x + circle_radius, center_y + circle_radius,
-                outline="green" if node.is_activated() else "red"
-            )
+                outline="red"
+            ))
             if add_ids:
                 self._canvas.create_text(center_x, center_y, text=str(node.get_id()))
-                self._canvas.create_text(center_x, center_y + circle_radius / 2, text=node.get_cluster_label(),
-                                         fill="red")
-
-    def _draw_connections(self, connections, cell_size, anchors):
-        circle_radius = self._get_circle_radius(cell_size)
-        connection_len = cell_size - circle_radius * 2
+                self._label_items.append(self._canvas.create_text(center_x, center_y + circle_radius / 2, text="",
+                                                                  fill="red"))
+            self._arrow_items.append(self._canvas.create_line(0, 0, 0, 0, state="hidden"))
 
-        for connection, anchor in zip(flatten(connections), anchors):
-            colors = {
-                True: "green",
-                False: "white"
-            }
-
-            width = 2
-
-            if connection[0] is not None:
-                # draw horizontal line
-                self._canvas.create_line(anchor[0] + circle_radius, anchor[1],
-                                         anchor[0] + circle_radius + connection_len, anchor[1],
-                                         fill=colors[connection[0]], width=width)
-            if connection[1] is not None:
-                # draw vertical line
-                self._canvas.create_line(anchor[0], anchor[1] + circle_radius,
-                                         anchor[0], anchor[1] + circle_radius + connection_len,
-                                         fill=colors[connection[1]], width=width)
-
-    def _draw_tree_connections(self, nodes: list, cell_size, anchors):
-        # for node_row in nodes:
-        #     for node in node_row:
-        #         assert isinstance(node, TreeNode), "Wrong node type: {}".format(type(node))
-
-        circle_radius = self._get_circle_radius(cell_size)
-
-        iter_list = list(zip(anchors, flatten(nodes)))
-
-        for anchor, node in iter_list:
+        if self._type == Visualizer.TYPE_BOND:
+            # one line per bond, in bond ids order: horizontal bonds row by row, then vertical ones (see Mesh)
+            side_size = len(nodes)
+            for bond_id in range(side_size * (side_size - 1)):
+                anchor = anchors[(bond_id // (side_size - 1)) * side_size + bond_id % (side_size - 1)]
+                self._bond_items.append(self._canvas.create_line(
+                    anchor[0] + circle_radius, anchor[1],
+                    anchor[0] + circle_radius + connection_len, anchor[1],
+                    fill=self.CONNECTION_COLORS[False], width=2))
+            for node_id in range(side_size * (side_size - 1)):
+                anchor = anchors[node_id]
+                self._bond_items.append(self._canvas.create_line(
+                    anchor[0], anchor[1] + circle_radius,
+                    anchor[0], anchor[1] + circle_radius + connection_len,
+                    fill=self.CONNECTION_COLORS[False], width=2))
+
+        # last drawn state of every item, only items which state was changed are updated
+        nodes_num = len(self._node_items)
+        self._drawn_active = [False] * nodes_num
+        self._drawn_labels = [None] * nodes_num
+        self._drawn_parents = [None] * nodes_num
+        self._drawn_bonds = np.zeros(len(self._bond_items), dtype=bool)
+
+    def _draw_nodes(self, nodes: list):
+        for i, node in enumerate(flatten(nodes)):
+            active = node.is_activated()
+            if active != self._drawn_active[i]:
+                self._canvas.itemconfigure(self._node_items[i], outline="green" if active else "red")
+                self._drawn_active[i] = active
+            if self._label_items:
+                label = node.get_cluster_label()
+                if label != self._drawn_labels[i]:
+                    self._canvas.itemconfigure(self._label_items[i], text="" if label is None else label)
+                    self._drawn_labels[i] = label
+
+    def _draw_connections(self, connections):
+        # connections - bonds activation state array of Mesh.all_bonds
+        bonds = np.array(connections)
+        for i in np.flatnonzero(bonds != self._drawn_bonds).tolist():
+            self._canvas.itemconfigure(self._bond_items[i], fill=self.CONNECTION_COLORS[bool(bonds[i])])
+        self._drawn_bonds = bonds
+
+    def _draw_tree_connections(self, nodes: list):
+        # only arrows of nodes which parent was changed (merged clusters, compressed paths) are moved
+        circle_radius = self._get_circle_radius(self._cell_size)
+
+        for i, node in enumerate(flatten(nodes)):
             par = node.get_parent()
-            if par is None:
+            node_parent_id = None if par is None else par.get_id()
+            if node_parent_id == self._drawn_parents[i]:
+                continue
+            self._drawn_parents[i] = node_parent_id
+
+            arrow_item = self._arrow_items[i]
+            if node_parent_id is None:
+                self._canvas.itemconfigure(arrow_item, state="hidden")
                 continue
-            node_parent_id = par.get_id()
-            parent_anchor = iter_list[node_parent_id][0]
+            anchor, parent_anchor = self._anchors[i], self._anchors[node_parent_id]
             points_were_reversed, p1, p2 = Visualizer._get_circles_intersections_with_centers_line(circle_radius,
                                                                                                    anchor[0], anchor[1],
                                                                                                    parent_anchor[0],
@@ -155,17 +191,24 @@ class Visualizer:
                 arrow = TK_LAST
             else:
                 arrow = TK_FIRST
-            self._canvas.create_line(p1[0], p1[1], p2[0], p2[1], arrow=arrow)
+            self._canvas.coords(arrow_item, p1[0], p1[1], p2[0], p2[1])
+            self._canvas.itemconfigure(arrow_item, arrow=arrow, state="normal")
 
-    def draw_mesh(self, mesh: Mesh, add_ids=True):
-        self._canvas.delete("all")
+    def draw_mesh(self, mesh: Mesh, add_ids=True, force=False):
+        # Frames are rate limited: call returns immediately if previous frame was drawn less than 1 / max_fps seconds
+        #   ago, so simulation may call it after every activation. force=True draws the frame anyway (e.g. last one)
+        now = time()
+        if not force and self._last_frame_time is not None and now - self._last_frame_time < 1 / self._max_fps:
+            return
+        self._last_frame_time = now
 
         nodes = mesh.all_nodes()
         bonds = mesh.all_bonds()
-        cell_size, anchors = side_size, anchors = self._get_anchors(len(nodes[0]), len(nodes))
-        self._draw_nodes(nodes, cell_size, anchors, add_ids=add_ids)
+        if self._node_items is None:
+            self._create_items(nodes, bonds, add_ids)
+        self._draw_nodes(nodes)
         if self._type == Visualizer.TYPE_BOND:
-            self._draw_connections(bonds, cell_size, anchors)
-        self._draw_tree_connections(nodes, cell_size, anchors)
+            self._draw_connections(bonds)
+        self._draw_tree_connections(nodes)
 
         self._root.update()
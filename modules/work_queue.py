@@ -0,0 +1,242 @@
+import collections
+import json
+import os
+import queue
+import socket
+import socketserver
+import threading
+import time
+
+# unit given to a worker which didn't return its results in this time (seconds) is given to another worker
+LEASE_TIMEOUT = 600
+# how often idle workers and coordinator look for new units and results (seconds)
+POLL_INTERVAL = 0.2
+
+
+# Work queue of distributed sweep: coordinator puts work units (experiments tasks of one (size, type) cell),
+#   workers on any host get them, run experiments and return records of results.
+#
+# Unit id is built from its tasks, and tasks seeds depend only on experiment key, so a unit run twice (its worker was
+#   lost, the unit was given to another one, then the first one came back) gives the same records. Coordinator takes
+#   only the first results of every unit, so retries are idempotent.
+#
+# Backends have the same interface:
+#   coordinator: put(unit), get_results(timeout) -> [(unit id, records)], requeue_expired(), close()
+#     (FileQueue coordinator calls clear() first)
+#   worker: get(worker_id) -> unit (waits for it) or None when the sweep is over, complete(unit, records)
+
+
+def make_unit(tasks, instrument=False):
+    # unit of tasks [(size, type, replica, seed)] of one cell with consecutive replicas,
+    #   instrument - workers add exported instrumentation.Counters to records
+    size, type, first_replica, _ = tasks[0]
+    return {"id": "{}-{}-{}-{}".format(size, type, first_replica, len(tasks)),
+            "tasks": [list(task) for task in tasks],
+            "instrument": instrument}
+
+
+def _write_json(path, data):
+    # readers never see partially written file
+    with open(path + ".tmp", "w") as f:
+        json.dump(data, f)
+    os.replace(path + ".tmp", path)
+
+
+class FileQueue:
+    # Queue in a directory on local or shared (e.g. NFS) filesystem:
+    #   pending/<unit id>.json - units waiting for a worker
+    #   leased/<unit id>.json.<worker id> - units being run, worker takes unit by renaming it here (rename is atomic,
+    #     so only one worker gets it), modification time is the lease start
+    #   results/<unit id>.json - records of finished units
+    #   stop - sweep is over
+
+    def __init__(self, directory, lease_timeout=LEASE_TIMEOUT):
+        self._directory = directory
+        self._lease_timeout = lease_timeout
+        for name in ("pending", "leased", "results"):
+            os.makedirs(os.path.join(directory, name), exist_ok=True)
+
+    def _path(self, *parts):
+        return os.path.join(self._directory, *parts)
+
+    def clear(self):
+        # coordinator starts with empty queue: units and results of previous session are not known to its scheduler
+        for name in ("pending", "leased", "results"):
+            for file_name in os.listdir(self._path(name)):
+                os.remove(self._path(name, file_name))
+        if os.path.exists(self._path("stop")):
+            os.remove(self._path("stop"))
+
+    def put(self, unit):
+        _write_json(self._path("pending", unit["id"] + ".json"), unit)
+
+    def get_results(self, timeout=None):
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            names = [name for name in os.listdir(self._path("results")) if name.endswith(".json")]
+            if names or (deadline is not None and time.time() >= deadline):
+                break
+            time.sleep(POLL_INTERVAL)
+        results = []
+        for name in names:
+            unit_id = name[:-len(".json")]
+            with open(self._path("results", name)) as f:
+                results.append((unit_id, json.load(f)))
+            os.remove(self._path("results", name))
+            # requeued copy of finished unit is not needed anymore
+            try:
+                os.remove(self._path("pending", name))
+            except FileNotFoundError:
+                pass
+        return results
+
+    def requeue_expired(self):
+        now = time.time()
+        for name in os.listdir(self._path("leased")):
+            path = self._path("leased", name)
+            try:
+                if now - os.path.getmtime(path) > self._lease_timeout:
+                    os.replace(path, self._path("pending", name[:name.index(".json") + len(".json")]))
+            except FileNotFoundError:
+                # completed meanwhile
+                pass
+
+    def close(self):
+        open(self._path("stop"), "w").close()
+
+    def get(self, worker_id):
+        while not os.path.exists(self._path("stop")):
+            for name in sorted(os.listdir(self._path("pending"))):
+                if not name.endswith(".json"):
+                    continue
+                leased_path = self._path("leased", "{}.{}".format(name, worker_id))
+                try:
+                    os.rename(self._path("pending", name), leased_path)
+                except FileNotFoundError:
+                    # taken by other worker
+                    continue
+                os.utime(leased_path)
+                with open(leased_path) as f:
+                    unit = json.load(f)
+                unit["lease"] = leased_path
+                return unit
+            time.sleep(POLL_INTERVAL)
+        return None
+
+    def complete(self, unit, records):
+        _write_json(self._path("results", unit["id"] + ".json"), records)
+        try:
+            os.remove(unit["lease"])
+        except FileNotFoundError:
+            # lease expired and unit was requeued
+            pass
+
+
+class SocketQueueServer:
+    # Coordinator side of queue served over TCP (one JSON line request and one JSON line reply per connection):
+    #   {"op": "get", "worker": id} -> {"unit": unit} / {"wait": true} / {"stop": true}
+    #   {"op": "complete", "unit_id": id, "records": [..]} -> {"ok": true}
+    # Workers connect with SocketQueueClient. port 0 - any free port, see get_address()
+    # Requests are not authenticated (any client can take units and send results), so server listens on loopback by
+    #   default and should be bound only to interfaces of trusted network
+
+    def __init__(self, host="127.0.0.1", port=0, lease_timeout=LEASE_TIMEOUT):
+        self._lease_timeout = lease_timeout
+        self._lock = threading.Lock()
+        # unit id -> unit
+        self._pending = collections.OrderedDict()
+        # unit id -> (unit, lease deadline)
+        self._leases = {}
+        self._results = queue.Queue()
+        self._stopped = False
+
+        server = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                request = json.loads(self.rfile.readline())
+                self.wfile.write((json.dumps(server._handle(request)) + "\n").encode())
+
+        self._server = socketserver.ThreadingTCPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def get_address(self):
+        return self._server.server_address
+
+    def _handle(self, request):
+        with self._lock:
+            if request["op"] == "get":
+                if self._stopped:
+                    return {"stop": True}
+                if not self._pending:
+                    return {"wait": True}
+                unit_id, unit = self._pending.popitem(last=False)
+                self._leases[unit_id] = (unit, time.time() + self._lease_timeout)
+                return {"unit": unit}
+            if request["op"] == "complete":
+                self._leases.pop(request["unit_id"], None)
+                self._pending.pop(request["unit_id"], None)
+                self._results.put((request["unit_id"], request["records"]))
+                return {"ok": True}
+        raise ValueError("Unknown request: {}".format(request["op"]))
+
+    def put(self, unit):
+        with self._lock:
+            self._pending[unit["id"]] = unit
+
+    def get_results(self, timeout=None):
+        try:
+            results = [self._results.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        while not self._results.empty():
+            results.append(self._results.get())
+        return results
+
+    def requeue_expired(self):
+        now = time.time()
+        with self._lock:
+            for unit_id, (unit, deadline) in list(self._leases.items()):
+                if deadline < now:
+                    del self._leases[unit_id]
+                    self._pending[unit_id] = unit
+
+    def close(self):
+        with self._lock:
+            self._stopped = True
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class SocketQueueClient:
+    # worker side of SocketQueueServer. Coordinator which is not reachable anymore means the sweep is over
+
+    def __init__(self, host, port):
+        self._address = (host, port)
+
+    def _request(self, request):
+        with socket.create_connection(self._address) as connection:
+            connection.sendall((json.dumps(request) + "\n").encode())
+            return json.loads(connection.makefile().readline())
+
+    def get(self, worker_id):
+        while True:
+            try:
+                reply = self._request({"op": "get", "worker": worker_id})
+            except (OSError, ValueError):
+                # refused, reset or timed out connection, or empty reply of closing server
+                return None
+            if "unit" in reply:
+                return reply["unit"]
+            if reply.get("stop"):
+                return None
+            time.sleep(POLL_INTERVAL)
+
+    def complete(self, unit, records):
+        try:
+            self._request({"op": "complete", "unit_id": unit["id"], "records": records})
+        except (OSError, ValueError):
+            # sweep is over, results are not needed
+            pass
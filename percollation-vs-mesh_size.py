@@ -1,10 +1,22 @@
+import math
 import multiprocessing
+import os
+import queue
+import secrets
+import subprocess
+import sys
 import time
-from itertools import groupby
-from main import conduct_experiment
+from main import conduct_experiment, run_tasks, open_result_cache
 from modules.structures import Mesh
+from modules.batch_mesh import BatchMesh
+from modules.results_store import ResultsStore
+from modules.scheduler import AdaptiveScheduler
+from modules.instrumentation import Counters
+from modules.analysis import load_thresholds, fit_sizes, analyze, format_analysis, CONFIDENCE
+from modules.work_queue import FileQueue, SocketQueueServer, make_unit
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "worker.py")
 
-import matplotlib.pyplot as plt
 from numpy import polyfit
 
 
@@ -17,24 +29,16 @@ def calculate_value_from_polynom_coeffs(coeffs: list, x):
     return res
 
 
-def construct_args_list_for_experiment_set():
-    mult_mesh_sizes = EXPERIMENTS_PER_SIZE * 2
-    mult_mesh_type = EXPERIMENTS_PER_SIZE * len(MESH_SIZES)
-    return (
-        zip(
-            MESH_SIZES * mult_mesh_sizes,
-            [Mesh.TYPE_NODE] * mult_mesh_type + [Mesh.TYPE_BOND] * mult_mesh_type
-        )
-    )
+def polyfit_measured(sizes, values, degree):
+    # polynom coeffs fitted to cells with results (value is not NaN), None if there are too few of them
+    measured = [(size, value) for size, value in zip(sizes, values) if not math.isnan(value)]
+    if len(measured) <= degree:
+        return None
+    return polyfit(*zip(*measured), degree)
 
 
-def get_results_for_type(avg_results, _type):
-    return list(map(
-        lambda res: res[1],
-        filter(
-            lambda res: res[0][0] == _type,
-            avg_results)
-    ))
+def run_experiment_tasks(tasks, instrument=False, cache_path=None):
+    return list(run_tasks(tasks, instrument, None if cache_path is None else open_result_cache(cache_path)))
 
 
 def get_avg_percollations_not_cool():
@@ -60,73 +64,242 @@ def get_avg_percollations_not_cool():
     return avg_percollations
 
 
+def make_scheduler(store):
+    master_seed = MASTER_SEED if MASTER_SEED is not None else secrets.randbits(64)
+    scheduler = AdaptiveScheduler([(mesh_size, t) for t in [Mesh.TYPE_NODE, Mesh.TYPE_BOND] for mesh_size in MESH_SIZES],
+                                  TOLERANCE, TIME_BUDGET, min_replicas=EXPERIMENTS_PER_SIZE, master_seed=master_seed)
+    # experiments stored in previous sessions are counted too
+    for chunk in store.iter_chunks():
+        for size, t, replica, threshold, runtime in zip(*[chunk[field].tolist() for field in
+                                                          ["size", "type", "replica", "threshold", "runtime"]]):
+            scheduler.add_result(int(size), int(t), int(replica), threshold, runtime, pending=False)
+    return scheduler, master_seed
+
+
+def finish_sweep(scheduler, store, stats_exports, start):
+    for t in [Mesh.TYPE_NODE, Mesh.TYPE_BOND]:
+        for mesh_size in MESH_SIZES:
+            cell = scheduler.get_cell_stats((mesh_size, t))
+            if cell.count == 0:
+                print("\tType {} size {}: no experiments".format(t, mesh_size))
+                continue
+            print("\tType {} size {}: {} experiments, standard error {:.3f}".format(
+                t, mesh_size, cell.count, cell.standard_error()))
+
+    if INSTRUMENT:
+        print("\tWhere the time went (all workers):\n\t\t" +
+              Counters.merge(stats_exports).report().replace("\n", "\n\t\t"))
+
+    # averages over all stored replicas (also from previous sessions), NaN - cell without results (e.g. time budget
+    #   was over before it was started)
+    avg_results = store.averages()
+    avg_percollations = {
+        t: [avg_results.get((t, mesh_size), math.nan) for mesh_size in MESH_SIZES]
+        for t in [Mesh.TYPE_BOND, Mesh.TYPE_NODE]
+    }
+    print("\tAll experiments were conducted! Time taken: {:.2f}s".format(time.time() - start))
+    return avg_percollations
+
+
 def get_avg_percollations_cool():
+    store = ResultsStore(RESULTS_PATH)
+    scheduler, master_seed = make_scheduler(store)
+
     print("Starting experiments in multiprocessing mode"
-          "\n\tProcesses_number: {}".format(PROCESSES))
+          "\n\tProcesses_number: {}"
+          "\n\tTarget standard error: {}, time budget: {}s"
+          "\n\tMaster seed: {}".format(PROCESSES, TOLERANCE, TIME_BUDGET, master_seed))
     start = time.time()
+    finished_records = queue.Queue()
+    stats_exports = []
     with multiprocessing.Pool(processes=PROCESSES) as pool:
-        results = pool.starmap(
-            conduct_experiment,
-            construct_args_list_for_experiment_set()
-        )
-
-    results_key = lambda x: (x[1], x[0])
-    avg_results = [
-        (
-            key,
-            sum([i[2] for i in values]) / EXPERIMENTS_PER_SIZE
-        )
-        for key, values in
-        groupby(
-            sorted(
-                results,
-                key=results_key
-            ),
-            key=results_key)
-    ]
+        in_flight = 0
+        while True:
+            # keeping all processes busy with experiments chosen by scheduler
+            while in_flight < PROCESSES * 2:
+                tasks = scheduler.next_tasks()
+                if tasks is None:
+                    break
+                pool.apply_async(run_experiment_tasks, (tasks, INSTRUMENT, CACHE_PATH), callback=finished_records.put,
+                                 error_callback=finished_records.put)
+                in_flight += 1
+            if in_flight == 0:
+                break
 
-    avg_percollations = {
-        Mesh.TYPE_BOND: get_results_for_type(avg_results, Mesh.TYPE_BOND),
-        Mesh.TYPE_NODE: get_results_for_type(avg_results, Mesh.TYPE_NODE),
-    }
+            # every result is stored as soon as it is ready, so interrupted sweep can be resumed
+            records = finished_records.get()
+            in_flight -= 1
+            if isinstance(records, Exception):
+                raise records
+            for record in records:
+                store.append(record)
+                if INSTRUMENT:
+                    stats_exports.append(record["stats"])
+                scheduler.add_result(record["size"], record["type"], record["replica"], record["threshold"],
+                                     record["runtime"])
+
+    return finish_sweep(scheduler, store, stats_exports, start)
+
+
+def get_avg_percollations_distributed():
+    # Coordinator of sweep run by workers (worker.py) on any hosts through work queue (see modules/work_queue.py).
+    #   Units which are not finished in QUEUE_LEASE_TIMEOUT are given to other workers, only the first results of
+    #   every unit are taken. QUEUE_LOCAL_WORKERS workers are started on this host
+    store = ResultsStore(RESULTS_PATH)
+    scheduler, master_seed = make_scheduler(store)
+    if WORK_QUEUE == "FILE":
+        work_queue = FileQueue(QUEUE_DIR, QUEUE_LEASE_TIMEOUT)
+        work_queue.clear()
+        worker_args = ["--queue", QUEUE_DIR]
+    else:
+        work_queue = SocketQueueServer(*QUEUE_ADDRESS, lease_timeout=QUEUE_LEASE_TIMEOUT)
+        host, port = work_queue.get_address()
+        worker_args = ["--connect", "{}:{}".format("127.0.0.1" if host == "0.0.0.0" else host, port)]
+
+    print("Starting experiments in distributed mode"
+          "\n\tQueue: {} {}, local workers: {}"
+          "\n\tTarget standard error: {}, time budget: {}s"
+          "\n\tMaster seed: {}".format(WORK_QUEUE, " ".join(worker_args), QUEUE_LOCAL_WORKERS, TOLERANCE,
+                                          TIME_BUDGET, master_seed))
+    if CACHE_PATH is not None:
+        worker_args += ["--cache", CACHE_PATH]
+    workers = [subprocess.Popen([sys.executable, WORKER_SCRIPT] + worker_args) for _ in range(QUEUE_LOCAL_WORKERS)]
+    start = time.time()
+    stats_exports = []
+    # unit id -> unit, units put to queue and not finished yet
+    in_flight = {}
+    try:
+        while True:
+            while len(in_flight) < QUEUE_UNITS_AHEAD:
+                tasks = scheduler.next_tasks()
+                if tasks is None:
+                    break
+                unit = make_unit(tasks, INSTRUMENT)
+                work_queue.put(unit)
+                in_flight[unit["id"]] = unit
+            if not in_flight:
+                break
+
+            for unit_id, records in work_queue.get_results(timeout=1):
+                # results of retried unit come once more
+                if in_flight.pop(unit_id, None) is None:
+                    continue
+                for record in records:
+                    store.append(record)
+                    if INSTRUMENT:
+                        stats_exports.append(record["stats"])
+                    scheduler.add_result(record["size"], record["type"], record["replica"], record["threshold"],
+                                         record["runtime"])
+            work_queue.requeue_expired()
+    finally:
+        work_queue.close()
+        for worker in workers:
+            worker.wait()
+
+    return finish_sweep(scheduler, store, stats_exports, start)
+
+
+def get_avg_percollations_lockstep():
+    # all experiments of one (mesh size, type) pair are simulated together as replicas of BatchMesh
+    print("Starting experiments in lockstep mode")
+    start = time.time()
+    avg_percollations = {}
+    for t in [Mesh.TYPE_BOND, Mesh.TYPE_NODE]:
+        avg_percollations[t] = [
+            BatchMesh(mesh_size, t, EXPERIMENTS_PER_SIZE).run().mean() for mesh_size in MESH_SIZES
+        ]
     print("\tAll experiments were conducted! Time taken: {:.2f}s".format(time.time() - start))
     return avg_percollations
 
 
 if __name__ == '__main__':
     MESH_SIZES = list(range(5, 41, 5))
-    EXPERIMENTS_PER_SIZE = 1
+    # multiprocessing mode: minimal number of experiments per (mesh size, type), others mode: exact number
+    EXPERIMENTS_PER_SIZE = 3
+    # multiprocessing mode runs experiments until standard error of every mean threshold is below TOLERANCE
+    #   (in activated items) or TIME_BUDGET (seconds, None - no limit) is over
+    TOLERANCE = 1.0
+    TIME_BUDGET = 600
+    # seed of experiment is derived from MASTER_SEED and experiment key (size, type, replica),
+    #   so any stored experiment can be reproduced. None - new master seed for every session
+    MASTER_SEED = None
+    # collect hot path counters and phases times in workers and print their sum
+    INSTRUMENT = False
     PROCESSES = 6
     GUESS_POLYNOM_DEGREE = 2
+    # True - replicas of each mesh size are simulated together in one process (BatchMesh),
+    #   False - one experiment per task in process pool
+    LOCKSTEP = False
+    # every finished experiment is appended here; experiments already stored are not rerun
+    RESULTS_PATH = "results/percollation-vs-mesh_size.csv"
+    # finite size scaling analysis of all stored replicas with bootstrap confidence intervals (multiprocessing mode)
+    ANALYSIS_BOOTSTRAP_DRAWS = 2000
+    # None - multiprocessing mode uses process pool of this host. FILE or SOCKET - experiments are run by workers
+    #   (python worker.py --queue QUEUE_DIR / --connect HOST:PORT) on any hosts through work queue in QUEUE_DIR
+    #   (shared filesystem) or served by this process on QUEUE_ADDRESS (port 0 - any free port). Socket queue has no
+    #   authentication, so it is served on loopback by default: for workers on other hosts set address of interface
+    #   in trusted network explicitly
+    WORK_QUEUE = None
+    QUEUE_DIR = "results/queue"
+    QUEUE_ADDRESS = ("127.0.0.1", 5555)
+    # workers started on this host, units given to workers at once and time (s) unit is waited for before retry
+    QUEUE_LOCAL_WORKERS = PROCESSES
+    QUEUE_UNITS_AHEAD = 4 * PROCESSES
+    QUEUE_LEASE_TIMEOUT = 600
+    # persistent cache of experiments results shared by sessions (None - disabled): experiments with the same
+    #   parameters, seed and simulation code are not rerun, e.g. when the results store is removed but MASTER_SEED is
+    #   the same
+    CACHE_PATH = "results/cache"
 
     print("Start experiments."
           "\n\tAim:\n\t\tMesh sizes: {}"
           "\n\t\tExperiments per mesh size: {}".format(list(MESH_SIZES),
                                                        EXPERIMENTS_PER_SIZE))
 
-    avg_percollations = get_avg_percollations_cool()
+    if LOCKSTEP:
+        avg_percollations = get_avg_percollations_lockstep()
+    elif WORK_QUEUE is not None:
+        avg_percollations = get_avg_percollations_distributed()
+    else:
+        avg_percollations = get_avg_percollations_cool()
+
+    if not LOCKSTEP:
+        store = ResultsStore(RESULTS_PATH)
+        for t, name in [(Mesh.TYPE_BOND, "Bond"), (Mesh.TYPE_NODE, "Node")]:
+            thresholds = load_thresholds(store, t)
+            if len(fit_sizes(thresholds)) < 3:
+                print("{} perc.: not enough stored experiments for finite size scaling analysis".format(name))
+                continue
+            res = analyze(thresholds, ANALYSIS_BOOTSTRAP_DRAWS, PROCESSES)
+            print("{} perc. finite size scaling analysis ({:.0%} intervals):\n\t{}".format(
+                name, CONFIDENCE, format_analysis(res).replace("\n", "\n\t")))
+
+    # imported here, so pool workers (which import this module with spawn start method) don't load it
+    import matplotlib.pyplot as plt
 
     plt.figure()
     plt.plot(MESH_SIZES, avg_percollations[Mesh.TYPE_BOND], 'go', label='Bond perc. experiment')
     plt.plot(MESH_SIZES, avg_percollations[Mesh.TYPE_NODE], 'bo', label='Node perc. experiment')
 
     print("Trying to fit points with Polynomial curve with a degree of 2")
-    coeffs_bond = polyfit(MESH_SIZES, avg_percollations[Mesh.TYPE_BOND], GUESS_POLYNOM_DEGREE)
-    coeffs_node = polyfit(MESH_SIZES, avg_percollations[Mesh.TYPE_NODE], GUESS_POLYNOM_DEGREE)
-    print("\tFound coeffs: \n"
+    coeffs_bond = polyfit_measured(MESH_SIZES, avg_percollations[Mesh.TYPE_BOND], GUESS_POLYNOM_DEGREE)
+    coeffs_node = polyfit_measured(MESH_SIZES, avg_percollations[Mesh.TYPE_NODE], GUESS_POLYNOM_DEGREE)
+    print("\tFound coeffs (None - too few sizes with results): \n"
           "\t\tBond: {}\n"
           "\t\tNode: {}".format(coeffs_bond, coeffs_node))
 
-    plt.plot(MESH_SIZES,
-             [calculate_value_from_polynom_coeffs(coeffs_bond, mesh_size) for mesh_size in MESH_SIZES],
-             'g-',
-             label='Bond perc. guess'
-             )
-    plt.plot(MESH_SIZES,
-             [calculate_value_from_polynom_coeffs(coeffs_node, mesh_size) for mesh_size in MESH_SIZES],
-             'b-',
-             label='Node perc. guess'
-             )
+    if coeffs_bond is not None:
+        plt.plot(MESH_SIZES,
+                 [calculate_value_from_polynom_coeffs(coeffs_bond, mesh_size) for mesh_size in MESH_SIZES],
+                 'g-',
+                 label='Bond perc. guess'
+                 )
+    if coeffs_node is not None:
+        plt.plot(MESH_SIZES,
+                 [calculate_value_from_polynom_coeffs(coeffs_node, mesh_size) for mesh_size in MESH_SIZES],
+                 'b-',
+                 label='Node perc. guess'
+                 )
 
     plt.legend(loc="lower right")
     plt.title("Percollation VS Mesh side size")
@@ -0,0 +1,31 @@
+import argparse
+import os
+import socket
+from main import run_tasks, open_result_cache
+from modules.work_queue import FileQueue, SocketQueueClient
+
+# Worker of distributed sweep (see percollation-vs-mesh_size.py): gets work units from the queue, runs their
+#   experiments and returns records until the sweep is over. Start as many workers as there are cores on every host.
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--queue", type=str, default=None,
+                       help="Directory of file queue (shared filesystem for workers on other hosts)")
+    group.add_argument("--connect", type=str, default=None, help="HOST:PORT of coordinator with socket queue")
+    parser.add_argument("--cache", type=str, default=None, help="Directory of persistent cache of experiments results")
+    args = parser.parse_args()
+    cache = None if args.cache is None else open_result_cache(args.cache)
+
+    if args.queue is not None:
+        work_queue = FileQueue(args.queue)
+    else:
+        host, port = args.connect.rsplit(":", 1)
+        work_queue = SocketQueueClient(host, int(port))
+
+    worker_id = "{}-{}".format(socket.gethostname(), os.getpid())
+    while True:
+        unit = work_queue.get(worker_id)
+        if unit is None:
+            break
+        work_queue.complete(unit, list(run_tasks(unit["tasks"], unit["instrument"], cache)))